@@ -1,2 +1,4 @@
 from.import models
-from.import wizard
\ No newline at end of file
+from.import wizard
+from.import report
+from.import controllers
\ No newline at end of file
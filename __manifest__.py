@@ -12,12 +12,23 @@
         'data/library_sequence.xml',
         'data/issue_mail_template.xml',         
         'data/welcome_email_template.xml',
+        'data/overdue_mail_template.xml',
+        'data/reservation_mail_template.xml',
+        'data/library_config_data.xml',
+        'data/library_cron.xml',
         'wizard/library_wizard_issue_return.xml',
+        'wizard/library_import_wizard.xml',
         # Load actions/views before menus to satisfy references
         'views/library_book_view.xml',
         'views/library_member_view.xml',
         'views/library_issue_view.xml',
+        'views/library_reservation_view.xml',
         'views/library_dashboard.xml',
+        'views/library_mail_job_view.xml',
+        'views/library_audit_view.xml',
+        'views/library_perf_view.xml',
+        'views/library_circulation_stats_view.xml',
+        'views/library_loan_history_view.xml',
         # Menus last (they reference actions above)
         'views/library_menu_view.xml',
         'report/library_issue_report.xml',    
@@ -0,0 +1,142 @@
+import functools
+import hashlib
+import json
+
+from werkzeug.exceptions import BadRequest
+
+from odoo import http
+from odoo.exceptions import AccessError, UserError
+from odoo.http import request
+from odoo.tools.date_utils import json_default
+
+API_ROOT = '/library_management/api/v1'
+# Largest number of scans, codes or members accepted by one request
+MAX_BATCH_SIZE = 500
+
+
+def _json_response(data, status=200):
+    body = json.dumps(data, separators=(',', ':'), default=json_default)
+    return request.make_response(body, headers=[('Content-Type', 'application/json; charset=utf-8')], status=status)
+
+
+def _error_response(status, message):
+    return _json_response({'error': message}, status)
+
+
+def kiosk_api(method):
+    """ Authenticate the request with an API key, sent as a bearer token or in
+    the ``X-Api-Key`` header, and run it as the key's user. Errors are sent
+    back as ``{"error": message}`` with the matching HTTP status. """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        headers = request.httprequest.headers
+        scheme, _sep, key = headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer':
+            key = headers.get('X-Api-Key', '')
+        uid = key.strip() and request.env['res.users.apikeys']._check_credentials(scope='rpc', key=key.strip())
+        if not uid:
+            return _error_response(401, "Invalid or missing API key.")
+        request.update_env(user=uid)
+        try:
+            return method(self, *args, **kwargs)
+        except (BadRequest, AccessError, UserError) as e:
+            # nothing of a refused batch is kept
+            request.env.cr.rollback()
+            if isinstance(e, BadRequest):
+                return _error_response(400, e.description)
+            return _error_response(403 if isinstance(e, AccessError) else 422, str(e))
+    return wrapper
+
+
+class LibraryApiController(http.Controller):
+    """ JSON API of the self-checkout kiosks and the campus portal. Each
+    request carries a whole batch of operations, run in one transaction
+    through the batched model methods, and gets a compact JSON answer. """
+
+    def _get_scans(self):
+        """ ``(code, membership_id)`` pairs of the JSON body, given as
+        ``{"scans": [{"code": ..., "member": ...}, ...]}``. """
+        try:
+            data = request.get_json_data()
+        except ValueError:
+            raise BadRequest("The request body is not valid JSON.")
+        scans = data.get('scans') if isinstance(data, dict) else None
+        if not isinstance(scans, list) or not all(
+                isinstance(scan, dict) and scan.get('code') and scan.get('member') for scan in scans):
+            raise BadRequest("Expected {\"scans\": [{\"code\": ..., \"member\": ...}, ...]}.")
+        if len(scans) > MAX_BATCH_SIZE:
+            raise BadRequest(f"At most {MAX_BATCH_SIZE} scans are accepted per request.")
+        return [(scan['code'], scan['member']) for scan in scans]
+
+    def _get_list_param(self, value, name):
+        values = list(dict.fromkeys(filter(None, (item.strip() for item in (value or '').split(',')))))
+        if not values:
+            raise BadRequest(f"The '{name}' parameter is required.")
+        if len(values) > MAX_BATCH_SIZE:
+            raise BadRequest(f"At most {MAX_BATCH_SIZE} values of '{name}' are accepted per request.")
+        return values
+
+    def _get_loans(self, issues):
+        return [{
+            'id': issue.id,
+            'isbn': issue.book_id.isbn13 or issue.book_id.isbn or None,
+            'copy': issue.copy_id.barcode or None,
+            'member': issue.member_id.membership_id,
+            'due': issue.return_date,
+        } for issue in issues]
+
+    @http.route(f'{API_ROOT}/checkout', type='http', auth='public', methods=['POST'], csrf=False)
+    @kiosk_api
+    def checkout(self, **kwargs):
+        Issue = request.env['library.issue']
+        result = Issue.checkout_scanned(self._get_scans())
+        return _json_response({
+            'issued': self._get_loans(Issue.browse(result['issued'])),
+            'errors': result['errors'],
+        })
+
+    @http.route(f'{API_ROOT}/return', type='http', auth='public', methods=['POST'], csrf=False)
+    @kiosk_api
+    def checkin(self, **kwargs):
+        Issue = request.env['library.issue']
+        result = Issue.bulk_return_scanned(self._get_scans())
+        return _json_response({
+            'returned': [{
+                'id': issue.id,
+                'isbn': issue.book_id.isbn13 or issue.book_id.isbn or None,
+                'member': issue.member_id.membership_id,
+                'penalty': issue.penalty,
+            } for issue in Issue.browse(result['returned'])],
+            'not_found': result['not_found'],
+        })
+
+    @http.route(f'{API_ROOT}/renew', type='http', auth='public', methods=['POST'], csrf=False)
+    @kiosk_api
+    def renew(self, **kwargs):
+        Issue = request.env['library.issue']
+        result = Issue.renew_scanned(self._get_scans())
+        return _json_response({
+            'renewed': self._get_loans(Issue.browse(result['renewed'])),
+            'not_found': result['not_found'],
+            'errors': result['errors'],
+        })
+
+    @http.route(f'{API_ROOT}/availability', type='http', auth='public', methods=['GET'])
+    @kiosk_api
+    def availability(self, codes=None, **kwargs):
+        """ Availability of the books scanned by ``codes``, comma-separated
+        copy barcodes or ISBNs. The answer carries an ETag: a kiosk polling
+        with ``If-None-Match`` gets an empty 304 while nothing changed. """
+        codes = self._get_list_param(codes, 'codes')
+        response = _json_response({'books': request.env['library.book'].get_availability(codes)})
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request.httprequest)
+
+    @http.route(f'{API_ROOT}/members', type='http', auth='public', methods=['GET'])
+    @kiosk_api
+    def members(self, ids=None, **kwargs):
+        """ Loan summary of the members given by ``ids``, comma-separated
+        membership ids. """
+        membership_ids = self._get_list_param(ids, 'ids')
+        return _json_response({'members': request.env['library.member'].get_loan_summary(membership_ids)})
@@ -0,0 +1,32 @@
+import tempfile
+
+from werkzeug.wsgi import wrap_file
+
+from odoo import http
+from odoo.http import request, content_disposition
+
+
+class LibraryController(http.Controller):
+
+    @http.route('/library_management/book_export/<int:export_id>', type='http', auth='user')
+    def book_export(self, export_id, **kwargs):
+        export = request.env['library.book.export'].browse(export_id).exists()
+        if not export:
+            return request.not_found()
+
+        # The workbook is built in a temporary file and streamed from there,
+        # it is never kept in memory nor stored as an attachment.
+        fileobj = tempfile.TemporaryFile()
+        export._write_xlsx(fileobj)
+        size = fileobj.tell()
+        fileobj.seek(0)
+        filename = export._get_filename()
+        export.unlink()
+        return request.make_response(
+            wrap_file(request.httprequest.environ, fileobj),
+            headers=[
+                ('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+                ('Content-Disposition', content_disposition(filename)),
+                ('Content-Length', str(size)),
+            ],
+        )
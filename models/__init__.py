@@ -1,4 +1,15 @@
+from . import ir_sequence
+from . import mail_message
+from . import library_audit
+from . import library_perf
 from . import library_book
+from . import library_book_copy
 from . import library_member
 from . import library_issue
+from . import library_issue_archive
+from . import library_reservation
 from . import library_dashboard
+from . import library_dashboard_snapshot
+from . import library_mail_job
+from . import library_circulation_stats
+from . import library_image_migration
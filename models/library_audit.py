@@ -0,0 +1,244 @@
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools import str2bool
+from collections import Counter
+from contextlib import contextmanager
+
+AUDIT_MODES = ('full', 'compact', 'off')
+
+
+class LibraryAuditMixin(models.AbstractModel):
+    """ Route the audit trail of the library documents according to the
+    ``library_management.audit_mode`` parameter:
+
+    * ``full``: chatter messages and tracking values (standard behaviour)
+    * ``compact``: one row per change in the append-only library.audit.log
+    * ``off``: nothing is recorded
+
+    Models list this mixin before ``mail.thread`` so that its ``create`` and
+    ``write`` run first and can turn the chatter tracking off. """
+    _name = 'library.audit.mixin'
+    _description = 'Library Audit Mixin'
+
+    @api.model
+    def _get_audit_mode(self):
+        mode = self.env['ir.config_parameter'].sudo().get_param('library_management.audit_mode', 'full')
+        return mode if mode in AUDIT_MODES else 'full'
+
+    @api.model
+    def _get_audit_tracked_fields(self):
+        return [fname for fname, field in self._fields.items() if getattr(field, 'tracking', None)]
+
+    @contextmanager
+    def _audit_operation(self, operation):
+        """ Attribute the mail and audit rows written meanwhile to the business
+        ``operation`` in library.mail.usage. Nested operations are part of
+        the outermost one. Does nothing unless the counters are enabled. """
+        if not self.env['library.mail.usage']._is_enabled():
+            yield
+            return
+        usage = self.env['library.mail.usage']._get_transaction_counters()
+        if usage['depth'] == 0:
+            usage['operation'] = operation
+            usage['counts'][operation, 'call_count'] += 1
+        usage['depth'] += 1
+        try:
+            yield
+        finally:
+            usage['depth'] -= 1
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        mode = self._get_audit_mode()
+        with self._audit_operation(f'{self._name}.create'):
+            if mode != 'full':
+                self = self.with_context(tracking_disable=True)
+            records = super().create(vals_list)
+            bodies = records._get_audit_create_bodies()
+            if mode == 'compact':
+                bodies = {record.id: bodies.get(record.id) or _("Created") for record in records}
+            records._audit_message(bodies, 'create')
+        return records
+
+    def _get_audit_create_bodies(self):
+        """ Creation messages ``{id: body}`` logged on top of the standard
+        creation message of the chatter. """
+        return {}
+
+    def write(self, vals):
+        mode = self._get_audit_mode()
+        if mode == 'full' or self.env.context.get('tracking_disable'):
+            with self._audit_operation(f'{self._name}.write'):
+                return super().write(vals)
+
+        with self._audit_operation(f'{self._name}.write'):
+            tracked = [fname for fname in self._get_audit_tracked_fields() if fname in vals]
+            old_values = {}
+            if mode == 'compact' and tracked:
+                old_values = {record.id: record._get_audit_values(tracked) for record in self}
+            res = super(LibraryAuditMixin, self.with_context(tracking_disable=True)).write(vals)
+            if old_values:
+                self.env['library.audit.log']._log_changes(self, old_values, tracked)
+        return res
+
+    def _get_audit_values(self, fnames):
+        self.ensure_one()
+        values = {}
+        for fname in fnames:
+            value = self[fname]
+            values[fname] = False if value is False else self._fields[fname].convert_to_display_name(value, self)
+        return values
+
+    def _audit_message(self, bodies, operation):
+        """ Record the messages ``{id: body}`` of a business operation.
+
+        In ``compact`` mode the whole batch is coalesced into one audit log
+        row listing the records. In ``full`` mode each record keeps its own
+        chatter message, as the chatter of a document only shows the
+        messages linked to it; they are inserted together. """
+        if not bodies:
+            return
+        mode = self._get_audit_mode()
+        if mode == 'full':
+            self._message_log_batch(bodies=bodies)
+        elif mode == 'compact':
+            res_ids = list(bodies)
+            self.env['library.audit.log'].sudo().create({
+                'res_model': self._name,
+                'res_id': res_ids[0] if len(res_ids) == 1 else False,
+                'res_ids': res_ids,
+                'operation': operation,
+                'body': "\n".join(bodies.values()),
+            })
+
+
+class LibraryAuditLog(models.Model):
+    _name = 'library.audit.log'
+    _description = 'Library Audit Log'
+    _order = 'id desc'
+
+    res_model = fields.Char(string="Document Model", required=True, readonly=True, index=True)
+    res_id = fields.Many2oneReference(string="Document", model_field='res_model', readonly=True, index=True,
+                                      help="The document, when the row is about a single one.")
+    res_ids = fields.Json(string="Document IDs", readonly=True,
+                          help="All the documents of the operation, which a bulk operation logs as one row.")
+    res_ids_text = fields.Char(string="Documents", compute='_compute_res_ids_text')
+    operation = fields.Char(string="Operation", required=True, readonly=True)
+    body = fields.Text(string="Message", readonly=True)
+    changes = fields.Json(string="Changes", readonly=True)
+    changes_text = fields.Text(string="Changed Values", compute='_compute_changes_text')
+
+    @api.depends('res_id', 'res_ids')
+    def _compute_res_ids_text(self):
+        for log in self:
+            log.res_ids_text = ", ".join(str(res_id) for res_id in log.res_ids or [log.res_id])
+
+    @api.depends('changes')
+    def _compute_changes_text(self):
+        for log in self:
+            log.changes_text = "\n".join(
+                f"{fname}: {old} → {new}" for fname, (old, new) in (log.changes or {}).items())
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        logs = super().create(vals_list)
+        self.env['library.mail.usage']._count('audit_count', len(logs))
+        return logs
+
+    def write(self, vals):
+        raise UserError(_("The audit log cannot be modified."))
+
+    @api.model
+    def _log_changes(self, records, old_values, fnames):
+        # one row per changed record, all inserted at once
+        vals_list = []
+        for record in records:
+            new_values = record._get_audit_values(fnames)
+            changes = {
+                fname: [old_values[record.id][fname], new_values[fname]]
+                for fname in fnames if old_values[record.id][fname] != new_values[fname]
+            }
+            if changes:
+                vals_list.append({
+                    'res_model': records._name,
+                    'res_id': record.id,
+                    'operation': 'write',
+                    'changes': changes,
+                })
+        self.sudo().create(vals_list)
+
+
+class LibraryMailUsage(models.Model):
+    """ Number of mail.message, mail.tracking.value and library.audit.log
+    rows written per business operation, to measure the audit overhead.
+    Counted only while the ``library_management.mail_usage_enabled``
+    parameter is set. """
+    _name = 'library.mail.usage'
+    _description = 'Library Mail Usage'
+    _order = 'operation'
+    _rec_name = 'operation'
+
+    operation = fields.Char(string="Operation", required=True, readonly=True)
+    call_count = fields.Integer(string="Calls", readonly=True)
+    message_count = fields.Integer(string="Messages", readonly=True)
+    tracking_count = fields.Integer(string="Tracking Values", readonly=True)
+    audit_count = fields.Integer(string="Audit Log Rows", readonly=True)
+    rows_per_call = fields.Float(string="Rows per Call", compute='_compute_rows_per_call')
+
+    _sql_constraints = [
+        ('operation_unique', 'UNIQUE(operation)', 'There can only be one usage counter per operation!'),
+    ]
+
+    @api.depends('call_count', 'message_count', 'tracking_count', 'audit_count')
+    def _compute_rows_per_call(self):
+        for usage in self:
+            rows = usage.message_count + usage.tracking_count + usage.audit_count
+            usage.rows_per_call = rows / usage.call_count if usage.call_count else 0.0
+
+    @api.model
+    def _is_enabled(self):
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param(
+            'library_management.mail_usage_enabled', 'False'))
+
+    @api.model
+    def _get_transaction_counters(self):
+        """ Counters of the current transaction, saved once it is committed. """
+        postcommit = self.env.cr.postcommit
+        usage = postcommit.data.get('library_mail_usage')
+        if usage is None:
+            usage = postcommit.data['library_mail_usage'] = {'operation': None, 'depth': 0, 'counts': Counter()}
+            registry = self.pool
+            table = self._table
+
+            @postcommit.add
+            def save_counters():
+                rows = {}
+                for (operation, column), count in usage['counts'].items():
+                    rows.setdefault(operation, dict.fromkeys(
+                        ('call_count', 'message_count', 'tracking_count', 'audit_count'), 0))[column] += count
+                if not rows:
+                    return
+                with registry.cursor() as cr:
+                    for operation, counts in rows.items():
+                        cr.execute(f"""
+                            INSERT INTO {table} (operation, call_count, message_count, tracking_count, audit_count)
+                            VALUES (%(operation)s, %(call_count)s, %(message_count)s, %(tracking_count)s, %(audit_count)s)
+                            ON CONFLICT (operation) DO UPDATE
+                               SET call_count = {table}.call_count + EXCLUDED.call_count,
+                                   message_count = {table}.message_count + EXCLUDED.message_count,
+                                   tracking_count = {table}.tracking_count + EXCLUDED.tracking_count,
+                                   audit_count = {table}.audit_count + EXCLUDED.audit_count
+                        """, dict(counts, operation=operation))
+        return usage
+
+    @api.model
+    def _count(self, column, count):
+        """ Add ``count`` rows to the operation running in this transaction.
+        Rows written after the operation (the chatter tracking is written at
+        commit time) go to the last operation of the transaction. """
+        usage = self.env.cr.postcommit.data.get('library_mail_usage')
+        if usage and usage['operation'] and count:
+            usage['counts'][usage['operation'], column] += count
+
+    def action_reset(self):
+        self.sudo().unlink()
@@ -1,22 +1,60 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
-import base64
-import io
+from odoo.tools import SQL, escape_psql
+from odoo.tools.safe_eval import safe_eval
+from .library_perf import profiled
+from .library_utils import get_int_param
+import re
 import xlsxwriter
 
+
+def normalize_isbn(isbn):
+    """ Strip spaces and hyphens from an ISBN and upper-case the X check digit. """
+    return re.sub(r'[\s-]', '', isbn or '').upper()
+
+
+def is_valid_isbn(isbn):
+    """ Check the checksum of a normalized ISBN-10 or ISBN-13. """
+    if re.fullmatch(r'\d{9}[\dX]', isbn):
+        total = sum((10 - i) * (10 if c == 'X' else int(c)) for i, c in enumerate(isbn))
+        return total % 11 == 0
+    if re.fullmatch(r'\d{13}', isbn):
+        total = sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(isbn))
+        return total % 10 == 0
+    return False
+
+
+def isbn_to_13(isbn):
+    """ Return the ISBN-13 form of a valid normalized ISBN, False otherwise.
+    ISBN-10 and ISBN-13 of the same book give the same value. """
+    if not is_valid_isbn(isbn):
+        return False
+    if len(isbn) == 13:
+        return isbn
+    body = '978' + isbn[:9]
+    check = (10 - sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(body)) % 10) % 10
+    return body + str(check)
+
+
 class LibraryBook(models.Model):
     _name = 'library.book'
     _description = 'Library Book'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['library.audit.mixin', 'mail.thread', 'mail.activity.mixin']
+    _rec_names_search = ['name', 'author', 'isbn']
 
-    name = fields.Char("Title", required=True, tracking=True)
-    author = fields.Char("Author", tracking=True)
+    # trigram indexes serve the ILIKE '%...%' searches of the catalogue
+    name = fields.Char("Title", required=True, tracking=True, index='trigram')
+    author = fields.Char("Author", tracking=True, index='trigram')
     isbn = fields.Char("ISBN", tracking=True)
+    isbn13 = fields.Char("ISBN-13", compute='_compute_isbn13', store=True, index=True,
+                         help="Normalized ISBN-13, also computed from ISBN-10, used for exact lookups.")
     publication_date = fields.Date("Publication Date", tracking=True)
     issue_ids = fields.One2many('library.issue', 'book_id', string="Issues")
+    history_ids = fields.One2many('library.loan.history', 'book_id', string="Loan History")
 
     num_copies = fields.Integer("Total Copies", tracking=True)
-    available_copies = fields.Integer(string="Available Copies", compute="_compute_available_copies", store=False)
+    copy_ids = fields.One2many('library.book.copy', 'book_id', string="Copies")
+    available_copies = fields.Integer(string="Available Copies", compute="_compute_issue_counters", store=True)
     available = fields.Boolean("Available", default=True)
 
     purchase_price = fields.Float("Purchase Price")
@@ -31,7 +69,7 @@ class LibraryBook(models.Model):
         ('other', 'Other'),
     ], string="Category/Genre", tracking=True)
 
-    times_issued = fields.Integer("Times Issued", compute="_compute_times_issued", store=False)
+    times_issued = fields.Integer("Times Issued", compute="_compute_issue_counters", store=True)
     
     _sql_constraints = [
             ('isbn_unique', 'UNIQUE(isbn)', 'The ISBN of the book must be unique!'),
@@ -44,83 +82,289 @@ class LibraryBook(models.Model):
             raise UserError("Cannot delete a book that is currently issued.")
         
 
-    @api.depends('num_copies')
-    def _compute_available_copies(self):
+    @api.depends('isbn')
+    def _compute_isbn13(self):
         for book in self:
-            issued_count = self.env['library.issue'].search_count([
-                ('book_id', '=', book.id),
-                ('state', '=', 'confirmed'),
-                ('issue_type', '=', 'issue')
-            ])
-            book.available_copies = max(book.num_copies - issued_count, 0)
-    
+            book.isbn13 = isbn_to_13(normalize_isbn(book.isbn))
+
+    @api.model
+    def _search_display_name(self, operator, value):
+        # an ISBN, with or without hyphens, 10 or 13 digits, is an exact lookup
+        if operator in ('ilike', '=', '=ilike') and isinstance(value, str):
+            isbn13 = isbn_to_13(normalize_isbn(value))
+            if isbn13:
+                return [('isbn13', '=', isbn13)]
+        return super()._search_display_name(operator, value)
+
+    @api.model
+    def name_search(self, name='', domain=None, operator='ilike', limit=100):
+        if not name or operator != 'ilike' or isbn_to_13(normalize_isbn(name)):
+            return super().name_search(name, domain, operator, limit)
+        # ranked: exact title, then title prefix, then best trigram match
+        books = self.browse(self._search_catalogue_ids(name, limit=limit, domain=domain))
+        return [(book.id, book.display_name) for book in books]
+
+    @api.model
+    def _search_catalogue_ids(self, text, limit=20, domain=None):
+        """ Ids of the books matching ``domain`` whose title or author
+        contains ``text`` (taken literally), best matches first. The ILIKE
+        filters are served by the trigram indexes. """
+        query = self._search(domain or [], limit=limit)
+        name = SQL.identifier(query.table, 'name')
+        pattern = escape_psql(text)
+        query.add_where(SQL("(%s ILIKE %s OR %s ILIKE %s)",
+                            name, f"%{pattern}%", SQL.identifier(query.table, 'author'), f"%{pattern}%"))
+        order = [SQL("lower(%s) = lower(%s) DESC", name, text), SQL("%s ILIKE %s DESC", name, f"{pattern}%")]
+        if self.env.registry.has_trigram:
+            order.append(SQL("similarity(%s, %s) DESC", name, text))
+        order.append(SQL.identifier(query.table, 'id'))
+        query.order = SQL(", ").join(order)
+        return list(query.get_result_ids())
+
+    @api.model
+    @profiled
+    def search_catalogue(self, query, limit=20):
+        """ Catalogue search API for the circulation desk: an ISBN gives its
+        book, any other text the best title/author matches. """
+        fnames = ['name', 'author', 'isbn', 'category', 'available_copies']
+        isbn13 = isbn_to_13(normalize_isbn(query or ''))
+        if isbn13:
+            return self.search_read([('isbn13', '=', isbn13)], fnames, limit=1)
+        if not query:
+            return []
+        books = self.browse(self._search_catalogue_ids(query, limit=limit))
+        return books.read(fnames)
+
+    @api.model
+    @profiled
+    def lookup_barcode(self, code):
+        """ Barcode-scanner lookup: an exact match on the indexed ISBN-13,
+        never a table scan. Returns the book values or False. """
+        isbn13 = isbn_to_13(normalize_isbn(code or ''))
+        if not isbn13:
+            return False
+        result = self.search_read([('isbn13', '=', isbn13)], ['name', 'author', 'isbn', 'available_copies'], limit=1)
+        return result[0] if result else False
+
+    @api.model
+    def _resolve_codes(self, codes):
+        """ Map scanned ``codes``, copy barcodes or ISBNs, to ``{code: (book,
+        copy)}`` with one indexed query per kind of code. The copy is empty
+        for an ISBN; unknown codes are left out. """
+        Copy = self.env['library.book.copy']
+        resolved = {copy.barcode: (copy.book_id, copy) for copy in Copy.search([('barcode', 'in', list(codes))])}
+        isbn13_by_code = {code: isbn_to_13(normalize_isbn(code)) for code in codes if code not in resolved}
+        books = self.search([('isbn13', 'in', [isbn13 for isbn13 in isbn13_by_code.values() if isbn13])])
+        book_by_isbn13 = {book.isbn13: book for book in books}
+        for code, isbn13 in isbn13_by_code.items():
+            if isbn13 in book_by_isbn13:
+                resolved[code] = (book_by_isbn13[isbn13], Copy)
+        return resolved
+
+    @api.model
+    @profiled
+    def get_availability(self, codes):
+        """ Availability of the books scanned by ``codes`` (copy barcodes or
+        ISBNs) for the kiosks, in a fixed number of queries whatever the
+        number of codes. Returns one dict per code, in the same order. """
+        resolved = self._resolve_codes(codes)
+        books = self.browse({book.id for book, _copy in resolved.values()})
+        waiting = dict(self.env['library.reservation']._read_group(
+            [('book_id', 'in', books.ids), ('state', '=', 'waiting')], ['book_id'], ['__count']))
+        result = []
+        for code in codes:
+            if code not in resolved:
+                result.append({'code': code, 'found': False})
+                continue
+            book, copy = resolved[code]
+            values = {
+                'code': code,
+                'found': True,
+                'book_id': book.id,
+                'isbn': book.isbn13 or book.isbn or None,
+                'title': book.name,
+                'copies': book.num_copies,
+                'available': book.available_copies,
+                'waiting': waiting.get(book, 0),
+            }
+            if copy:
+                values['copy_status'] = copy.status
+            result.append(values)
+        return result
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'num_copies' in vals:
+            self.env['library.book.copy']._sync_book_copies(self)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['library.dashboard.snapshot']._invalidate_dashboard_cache()
+        return res
+
+    def _decrement_stock(self):
+        """ Remove one copy from the stock of each book with an atomic
+        decrement, instead of a read-modify-write of num_copies that loses
+        concurrent updates. """
+        self.flush_recordset(['num_copies'])
+        self.env.cr.execute(f"UPDATE {self._table} SET num_copies = num_copies - 1 WHERE id IN %s", [tuple(self.ids)])
+        self.invalidate_recordset(['num_copies'])
+        self._trigger_issue_counters()
+
+    @api.depends('num_copies', 'issue_ids.state', 'issue_ids.issue_type')
+    def _compute_issue_counters(self):
+        # Both counters come from a single grouped query over library.issue,
+        # whatever the number of books being recomputed. Copies held for a
+        # reservation are not available either. Not clamped: more copies out
+        # than in stock is refused by the available_copies_positive check.
+        active_counts, total_counts = self._origin._get_issue_counts()
+        held_counts = {book.id: count for book, count in self.env['library.reservation']._read_group(
+            [('book_id', 'in', self._origin.ids), ('state', '=', 'held')], groupby=['book_id'], aggregates=['__count'])}
+        for book in self:
+            book_id = book._origin.id
+            book.available_copies = book.num_copies - active_counts.get(book_id, 0) - held_counts.get(book_id, 0)
+            book.times_issued = total_counts.get(book_id, 0)
+
+    def _get_issue_counts(self):
+        """ Return two dicts ``{book_id: count}``: the confirmed 'issue' loans
+        (copies currently out) and all issue records, archived ones included,
+        for the books in self. """
+        active_counts, total_counts = {}, {}
+        if not self.ids:
+            return active_counts, total_counts
+        groups = self.env['library.issue']._read_group(
+            [('book_id', 'in', self.ids)],
+            groupby=['book_id', 'state', 'issue_type'],
+            aggregates=['__count'],
+        )
+        for book, state, issue_type, count in groups:
+            total_counts[book.id] = total_counts.get(book.id, 0) + count
+            if state == 'confirmed' and issue_type == 'issue':
+                active_counts[book.id] = active_counts.get(book.id, 0) + count
+        for book, count in self.env['library.issue.archive']._read_group(
+                [('book_id', 'in', self.ids)], groupby=['book_id'], aggregates=['__count']):
+            total_counts[book.id] = total_counts.get(book.id, 0) + count
+        return active_counts, total_counts
+
+    def _trigger_issue_counters(self):
+        """ Mark the stored issue counters of these books as outdated. The ORM
+        recomputes all marked books in one batch on the next read or flush. """
+        for fname in ('available_copies', 'times_issued'):
+            self.env.add_to_compute(self._fields[fname], self)
+
+    @api.model
+    def _recompute_issue_counters(self, batch_size=5000):
+        """ Repair job: rebuild the stored counters of every book, in batches. """
+        books = self.search([])
+        for start in range(0, len(books), batch_size):
+            batch = books[start:start + batch_size]
+            batch._trigger_issue_counters()
+            batch.flush_recordset(['available_copies', 'times_issued'])
+            batch.invalidate_recordset()
+        return True
+
+    @profiled
     def print_issued_users_report(self):
         return self.env.ref('library_management.action_report_book_issued_users').report_action(self)
     
+    @profiled
     def action_export_book_excel(self):
-        for book in self:
-            output = io.BytesIO()
-            workbook = xlsxwriter.Workbook(output)
-            sheet = workbook.add_worksheet('Book Info')
-
-            sheet.write('A1', 'Name')
-            sheet.write('B1', book.name or '')
-            sheet.write('A2', 'Author')
-            sheet.write('B2', book.author or '')
-            sheet.write('A3', 'ISBN')
-            sheet.write('B3', book.isbn or '')
-            sheet.write('A4', 'Publication Date')
-            sheet.write('B4', str(book.publication_date) or '')
-            sheet.write('A5', 'Copies')
-            sheet.write('B5', book.num_copies or 0)
-            sheet.write('A6', 'Available Copies')
-            sheet.write('B6', book.available_copies or 0)
-            sheet.write('A7', 'Category')
-            sheet.write('B7', dict(book._fields['category'].selection).get(book.category, '') or '')
-            sheet.write('A8', 'Purchase Price')
-            sheet.write('B8', book.purchase_price or 0.0)
-            sheet.write('A9', 'Issue Price')
-            sheet.write('B9', book.issue_price or 0.0)
-
-            workbook.close()
-            output.seek(0)
-            excel_data = output.read()
-            output.close()
-
-            # Create attachment
-            attachment = self.env['ir.attachment'].create({
-                'name': f'{book.name}_info.xlsx',
-                'type': 'binary',
-                'datas': base64.b64encode(excel_data),
-                'res_model': 'library.book',
-                'res_id': book.id,
-                'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            })
-
-            return {
-                'type': 'ir.actions.act_url',
-                'url': f'/web/content/{attachment.id}?download=true',
-                'target': 'new',
-            }
-    
-    @api.model
-    def create(self, vals):
-        record = super(LibraryBook, self).create(vals)
-        if self.env.context.get('from_ui'):
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'rainbow_man',
-                'params': {
-                    'message': 'Book added successfully!',
-                    'fadeout': 'slow',
-                    'title': 'New Book 📚',
-                }
+        # The list view always sends its search domain, but the records are
+        # the selection. Only with "select all" over more records than the
+        # client fetches at once (web.active_ids_limit) is the selection cut
+        # short, and then the domain is exported rather than the truncated ids.
+        domain = [('id', 'in', self.ids)]
+        context = self.env.context
+        if context.get('active_model') == 'library.book' and context.get('active_domain') is not None:
+            limit = get_int_param(self.env, 'web.active_ids_limit', 20000, minimum=1)
+            if len(self) >= limit:
+                domain = context['active_domain']
+        export = self.env['library.book.export'].create({'domain': repr(domain)})
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/library_management/book_export/{export.id}',
+            'target': 'new',
+        }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(LibraryBook, self).create(vals_list)
+        self.env['library.book.copy']._sync_book_copies(records)
+        self.env['library.dashboard.snapshot']._invalidate_dashboard_cache()
+        return records
+
+    def action_book_added(self):
+        # "Add Book" button of a new book's form: the form saves the record
+        # before calling it, the celebration is left to the web client
+        self.ensure_one()
+        return {
+            'effect': {
+                'type': 'rainbow_man',
+                'message': _("Book added successfully!"),
+                'fadeout': 'slow',
             }
-        return record     
-    @api.depends()
-    def _compute_times_issued(self):
-        for book in self:
-            book.times_issued = self.env['library.issue'].search_count([
-                ('book_id', '=', book.id)
-            ])
-     
+        }
+
+
+# (header, column width) of the catalogue export sheet
+EXPORT_COLUMNS = [
+    ('Name', 40), ('Author', 30), ('ISBN', 18), ('Publication Date', 16), ('Category', 18),
+    ('Copies', 10), ('Available Copies', 16), ('Issued Copies', 14), ('Times Issued', 14),
+    ('Purchase Price', 14), ('Issue Price', 12),
+]
+EXPORT_FIELDS = ['name', 'author', 'isbn', 'publication_date', 'category', 'num_copies',
+                 'available_copies', 'times_issued', 'purchase_price', 'issue_price']
+
+
+class LibraryBookExport(models.TransientModel):
+    _name = 'library.book.export'
+    _description = 'Library Book Catalogue Export'
+
+    domain = fields.Text(string="Domain", default="[]", required=True)
+
+    def _get_filename(self):
+        return f"library_catalogue_{fields.Date.context_today(self)}.xlsx"
+
+    def _write_xlsx(self, fileobj):
+        """ Write every book matching the export domain into one sheet of
+        ``fileobj``. Rows are flushed to disk as they are written
+        (constant_memory) and books are read in prefetch-sized chunks with the
+        record cache cleared in between, so memory stays bounded whatever the
+        size of the catalogue. """
+        self.ensure_one()
+        Book = self.env['library.book']
+        book_ids = Book.search(safe_eval(self.domain), order='name, id').ids
+        categories = dict(Book._fields['category']._description_selection(self.env))
+
+        workbook = xlsxwriter.Workbook(fileobj, {'constant_memory': True, 'in_memory': False})
+        sheet = workbook.add_worksheet('Books')
+        bold = workbook.add_format({'bold': True})
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        for col, (header, width) in enumerate(EXPORT_COLUMNS):
+            sheet.set_column(col, col, width)
+            sheet.write(0, col, header, bold)
+
+        row = 1
+        for start in range(0, len(book_ids), models.PREFETCH_MAX):
+            books = Book.browse(book_ids[start:start + models.PREFETCH_MAX])
+            books.fetch(EXPORT_FIELDS)
+            # copies currently out, for the whole chunk in one grouped query
+            active_counts, _total_counts = books._get_issue_counts()
+            for book in books:
+                sheet.write_string(row, 0, book.name or '')
+                sheet.write_string(row, 1, book.author or '')
+                sheet.write_string(row, 2, book.isbn or '')
+                if book.publication_date:
+                    sheet.write_datetime(row, 3, book.publication_date, date_format)
+                sheet.write_string(row, 4, categories.get(book.category, '') or '')
+                sheet.write_number(row, 5, book.num_copies or 0)
+                sheet.write_number(row, 6, book.available_copies or 0)
+                sheet.write_number(row, 7, active_counts.get(book.id, 0))
+                sheet.write_number(row, 8, book.times_issued or 0)
+                sheet.write_number(row, 9, book.purchase_price or 0.0)
+                sheet.write_number(row, 10, book.issue_price or 0.0)
+                row += 1
+            self.env.invalidate_all()
+
+        workbook.close()
@@ -0,0 +1,125 @@
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+from collections import defaultdict
+
+# Statuses of a copy that is part of the library stock
+IN_STOCK_STATUSES = ('available', 'loaned', 'reserved')
+
+
+class LibraryBookCopy(models.Model):
+    _name = 'library.book.copy'
+    _description = 'Library Book Copy'
+    _rec_name = 'barcode'
+    _order = 'book_id, id'
+
+    book_id = fields.Many2one('library.book', string="Book", required=True, index=True, ondelete='cascade')
+    barcode = fields.Char(string="Barcode", required=True, copy=False, index=True,
+                          default=lambda self: self.env['ir.sequence'].next_by_code('library.book.copy') or '/')
+    status = fields.Selection([
+        ('available', 'Available'),
+        ('loaned', 'Loaned'),
+        ('reserved', 'Reserved'),
+        ('sold', 'Sold'),
+        ('lost', 'Lost'),
+        ('withdrawn', 'Withdrawn'),
+    ], string="Status", default='available', required=True)
+    location = fields.Char(string="Location")
+    issue_ids = fields.One2many('library.issue', 'copy_id', string="Loans")
+
+    _sql_constraints = [
+        ('barcode_unique', 'UNIQUE(barcode)', 'The barcode of a book copy must be unique!'),
+    ]
+
+    def init(self):
+        # free copies of a book are found through this small partial index
+        create_index(self.env.cr, 'library_book_copy_available_index', self._table, ['book_id'],
+                     where="status = 'available'")
+
+    @api.model
+    def _claim(self, book, document, status='loaned', copy=None):
+        """ Atomically take one free copy of ``book`` for ``document`` (an
+        issue or a reservation) and give it ``status``. Returns the copy, or
+        an empty recordset if none is free. Given a ``copy`` (scanned at a
+        kiosk), only that one is taken.
+
+        The free copy is picked and updated by a single statement; copies
+        being claimed by concurrent transactions are skipped rather than
+        waited for, so two desks can never get the same copy. """
+        self.flush_model()
+        column, value = ('id', copy.id) if copy else ('book_id', book.id)
+        self.env.cr.execute(f"""
+            UPDATE {self._table} SET status = %s, write_uid = %s, write_date = NOW() AT TIME ZONE 'UTC'
+             WHERE id = (
+                    SELECT id FROM {self._table}
+                     WHERE {column} = %s AND status = 'available'
+                     ORDER BY id
+                     LIMIT 1
+                       FOR UPDATE SKIP LOCKED
+             )
+         RETURNING id
+        """, [status, self.env.uid, value])
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        copy = self.browse(row[0])
+        copy.invalidate_recordset(['status'])
+        document.copy_id = copy
+        return copy
+
+    def _release(self):
+        # back on the shelf, a copy that was sold or lost stays so, then
+        # goes to the first member waiting for the book if any
+        copies = self.filtered(lambda c: c.status in ('loaned', 'reserved'))
+        copies.write({'status': 'available'})
+        self.env['library.reservation']._allocate(copies)
+
+    @api.model
+    def _sync_book_copies(self, books):
+        """ Create or withdraw copies so that each book has ``num_copies``
+        copies in stock. Open loans without a copy (made before copies were
+        tracked) get one, created as loaned. """
+        if not books:
+            return
+        in_stock = dict(self._read_group(
+            [('book_id', 'in', books.ids), ('status', 'in', IN_STOCK_STATUSES)],
+            groupby=['book_id'], aggregates=['__count'],
+        ))
+        untracked_loans = defaultdict(lambda: self.env['library.issue'])
+        for loan in self.env['library.issue'].search([
+            ('book_id', 'in', books.ids),
+            ('state', '=', 'confirmed'),
+            ('issue_type', '=', 'issue'),
+            ('copy_id', '=', False),
+        ]):
+            untracked_loans[loan.book_id] |= loan
+
+        vals_list, loans_to_link, to_withdraw = [], [], self.browse()
+        for book in books:
+            missing = book.num_copies - in_stock.get(book, 0)
+            if missing > 0:
+                loans = untracked_loans[book][:missing]
+                loans_to_link += list(loans)
+                vals_list += [{'book_id': book.id, 'status': 'loaned'} for _loan in loans]
+                vals_list += [{'book_id': book.id} for _i in range(missing - len(loans))]
+            elif missing < 0:
+                to_withdraw |= self.search([('book_id', '=', book.id), ('status', '=', 'available')],
+                                           limit=-missing, order='id desc')
+
+        if vals_list:
+            # barcodes of the whole batch come from a single sequence call
+            barcodes = self.env['ir.sequence']._next_block_by_code('library.book.copy', len(vals_list))
+            for vals, barcode in zip(vals_list, barcodes):
+                vals['barcode'] = barcode
+            copies = self.create(vals_list)
+            loaned = copies.filtered(lambda c: c.status == 'loaned')
+            for loan, copy in zip(loans_to_link, loaned):
+                loan.copy_id = copy
+            # new copies serve the waiting lists first
+            self.env['library.reservation']._allocate(copies - loaned)
+        to_withdraw.write({'status': 'withdrawn'})
+
+    def action_mark_lost(self):
+        self.write({'status': 'lost'})
+
+    def action_withdraw(self):
+        self.filtered(lambda c: c.status == 'available').write({'status': 'withdrawn'})
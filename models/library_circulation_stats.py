@@ -0,0 +1,136 @@
+from odoo import models, fields, api
+
+
+class LibraryCirculationStats(models.Model):
+    """ Daily circulation figures per book, category and member type.
+
+    The table is a materialization of the loan history (running and archived
+    loans) maintained by the module itself: PostgreSQL materialized views can
+    only be refreshed as a whole, whereas this table is refreshed
+    incrementally by recomputing only the days touched by the issues modified
+    since the previous refresh. Archiving loans does not change the figures. """
+    _name = 'library.circulation.stats'
+    _description = 'Library Circulation Statistics'
+    _auto = False
+    _order = 'date desc'
+    _rec_name = 'date'
+
+    date = fields.Date(string="Date", readonly=True)
+    book_id = fields.Many2one('library.book', string="Book", readonly=True)
+    category = fields.Selection(selection=lambda self: self.env['library.book']._fields['category'].selection,
+                                string="Category", readonly=True)
+    user_type = fields.Selection(selection=lambda self: self.env['library.member']._fields['user_type'].selection,
+                                 string="Member Type", readonly=True)
+    issue_count = fields.Integer(string="Issues", readonly=True, aggregator='sum')
+    purchase_count = fields.Integer(string="Purchases", readonly=True, aggregator='sum')
+    return_count = fields.Integer(string="Returns", readonly=True, aggregator='sum')
+    penalty_amount = fields.Float(string="Penalties", readonly=True, aggregator='sum')
+    revenue = fields.Float(string="Revenue", readonly=True, aggregator='sum')
+
+    def init(self):
+        cr = self.env.cr
+        cr.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self._table} (
+                id serial PRIMARY KEY,
+                date date NOT NULL,
+                book_id integer,
+                category varchar,
+                user_type varchar,
+                issue_count integer NOT NULL DEFAULT 0,
+                purchase_count integer NOT NULL DEFAULT 0,
+                return_count integer NOT NULL DEFAULT 0,
+                penalty_amount double precision NOT NULL DEFAULT 0,
+                revenue double precision NOT NULL DEFAULT 0
+            )
+        """)
+        cr.execute(f"CREATE INDEX IF NOT EXISTS {self._table}_date_index ON {self._table} (date)")
+        # days to recompute whatever the write date of the issues: the days a
+        # modified issue no longer counts in, or those of a deleted one. An
+        # append-only log without unique key, deduplicated by the refresh, so
+        # that concurrent transactions never wait on each other's rows
+        cr.execute(f"CREATE TABLE IF NOT EXISTS {self._table}_outdated (date date NOT NULL)")
+        cr.execute(f"ALTER TABLE {self._table}_outdated DROP CONSTRAINT IF EXISTS {self._table}_outdated_pkey")
+
+    @api.model
+    def _mark_outdated(self, days):
+        """ Have the next refresh recompute ``days``. """
+        days = sorted(day for day in days if day)
+        if days:
+            self.env.cr.execute(f"INSERT INTO {self._table}_outdated (date) SELECT unnest(%s::date[])", [days])
+
+    @api.model
+    def _get_source_query(self, day_filter):
+        """ SELECT producing the rows of the days matched by ``day_filter``,
+        a SQL condition on the column ``day``. """
+        return f"""
+            SELECT day, book_id, category, user_type,
+                   SUM(issues), SUM(purchases), SUM(returns), SUM(penalty), SUM(revenue)
+              FROM (
+                    SELECT i.issue_date AS day, i.book_id, b.category, m.user_type,
+                           (i.issue_type = 'issue')::int AS issues,
+                           (i.issue_type = 'purchase')::int AS purchases,
+                           0 AS returns, 0.0 AS penalty,
+                           COALESCE(i.price_to_pay, 0.0) AS revenue
+                      FROM library_loan_history i
+                      JOIN library_book b ON b.id = i.book_id
+                      JOIN library_member m ON m.id = i.member_id
+                     WHERE i.state IN ('confirmed', 'returned') AND i.issue_date IS NOT NULL
+                 UNION ALL
+                    SELECT COALESCE(i.actual_return_date, i.return_date), i.book_id, b.category, m.user_type,
+                           0, 0, 1, COALESCE(i.penalty, 0.0), 0.0
+                      FROM library_loan_history i
+                      JOIN library_book b ON b.id = i.book_id
+                      JOIN library_member m ON m.id = i.member_id
+                     WHERE i.state = 'returned' AND COALESCE(i.actual_return_date, i.return_date) IS NOT NULL
+                   ) AS circulation
+             WHERE {day_filter}
+             GROUP BY day, book_id, category, user_type
+        """
+
+    @api.model
+    def _refresh(self, full=False):
+        """ Bring the statistics up to date. Only the days touched by issues
+        written since the previous refresh, and those marked as outdated,
+        are recomputed, unless ``full``. """
+        cr = self.env.cr
+        ICP = self.env['ir.config_parameter'].sudo()
+        self.env['library.issue'].flush_model()
+        cr.execute("SELECT NOW() AT TIME ZONE 'UTC'")
+        refresh_start = cr.fetchone()[0]
+        watermark = ICP.get_param('library_management.circulation_stats_watermark')
+        columns = "date, book_id, category, user_type, issue_count, purchase_count, return_count, penalty_amount, revenue"
+
+        if full or not watermark:
+            cr.execute(f"TRUNCATE {self._table}, {self._table}_outdated")
+            cr.execute(f"INSERT INTO {self._table} ({columns}) {self._get_source_query('TRUE')}")
+        else:
+            # write_date is the start of the writing transaction, which may
+            # commit after this refresh: look back a little further to
+            # catch those (served by the write_date index)
+            cr.execute(f"""
+                WITH outdated AS (DELETE FROM {self._table}_outdated RETURNING date)
+                SELECT date FROM outdated
+                 UNION
+                SELECT issue_date FROM library_issue
+                 WHERE write_date >= %s::timestamp - interval '1 hour' AND issue_date IS NOT NULL
+                 UNION
+                SELECT COALESCE(actual_return_date, return_date) FROM library_issue
+                 WHERE write_date >= %s::timestamp - interval '1 hour'
+                   AND COALESCE(actual_return_date, return_date) IS NOT NULL
+            """, [watermark, watermark])
+            days = [row[0] for row in cr.fetchall()]
+            if days:
+                cr.execute(f"DELETE FROM {self._table} WHERE date = ANY(%s)", [days])
+                cr.execute(f"INSERT INTO {self._table} ({columns}) {self._get_source_query('day = ANY(%s)')}", [days])
+
+        ICP.set_param('library_management.circulation_stats_watermark', fields.Datetime.to_string(refresh_start))
+        self.env.invalidate_all()
+
+    @api.model
+    def _cron_refresh(self):
+        self._refresh()
+
+    @api.model
+    def _cron_full_refresh(self):
+        # also catches the changes of book categories and member types
+        self._refresh(full=True)
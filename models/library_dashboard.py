@@ -1,6 +1,6 @@
 from odoo import models, fields, api
-from collections import Counter
-from datetime import date
+from .library_perf import profiled
+from .library_utils import get_int_param
 
 class LibraryDashboard(models.TransientModel):
     _name = 'library.dashboard'
@@ -22,51 +22,58 @@ class LibraryDashboard(models.TransientModel):
 
         
     @api.model
+    @profiled
     def default_get(self, fields_list):
         res = super().default_get(fields_list)
+        res.update(self.env['library.dashboard.snapshot']._get_dashboard_values())
 
-        # Basic counts
+# Make sure to include display_name in the result if requested
+        if 'display_name' in fields_list:
+            res['display_name'] = f"Library Dashboard - {fields.Date.context_today(self)}"
+        
+        return res
+
+    @api.model
+    def _get_top_books_limit(self):
+        # Number of books listed under "Most Issued Books"
+        return get_int_param(self.env, 'library_management.dashboard_top_books', 3, minimum=1)
+
+    @api.model
+    def _get_dashboard_values(self):
+        Issue = self.env['library.issue']
+
+        # Basic counts: one grouped query for all issue states
+        count_by_state = dict(Issue._read_group([], groupby=['state'], aggregates=['__count']))
         total_books = self.env['library.book'].search_count([])
         total_members = self.env['library.member'].search_count([])
-        total_issued = self.env['library.issue'].search_count([('state', '=', 'confirmed')])
-        total_returned = self.env['library.issue'].search_count([('state', '=', 'returned')])
 
-        # Find most issued books manually (only for confirmed issues)
-        issues = self.env['library.issue'].search([('state', '=', 'confirmed')])
-        book_ids = [issue.book_id.id for issue in issues if issue.book_id]
-        count_by_book = Counter(book_ids)
+        # Most issued books (only for confirmed issues), ranked in SQL
+        top_books = Issue._read_group(
+            [('state', '=', 'confirmed'), ('book_id', '!=', False)],
+            groupby=['book_id'],
+            aggregates=['__count'],
+            order='__count desc, book_id',
+            limit=self._get_top_books_limit(),
+        )
+        book_names = [book.name or "Unknown" for book, _count in top_books]
 
-        # Get top 3 book IDs
-        top_books_ids = [book_id for book_id, _ in count_by_book.most_common(3)]
-        book_names = []
-        books = self.env['library.book'].browse(top_books_ids)
-
-        for book in books:
-            book_names.append(book.name or "Unknown")
-            
-        # Books Due Today
-        today = date.today()
-        issue_model = self.env['library.issue']
-        due_today_records = issue_model.search([
-            ('return_date', '=', today),
-            ('state', '=', 'confirmed')
-        ])
-        due_list = [f"{rec.book_id.name} - {rec.member_id.name}" for rec in due_today_records if rec.book_id and rec.member_id]
+        # Books Due Today, with book and member names fetched in batch
+        due_today_records = Issue.search_fetch([
+            ('return_date', '=', fields.Date.context_today(self)),
+            ('state', '=', 'confirmed'),
+            ('book_id', '!=', False),
+            ('member_id', '!=', False),
+        ], ['book_id', 'member_id'])
+        due_today_records.book_id.fetch(['name'])
+        due_today_records.member_id.fetch(['name'])
+        due_list = [f"{rec.book_id.name} - {rec.member_id.name}" for rec in due_today_records]
         due_text = "\n".join(due_list) if due_list else "No books due today."
 
-        # Update dashboard fields
-        res.update({
+        return {
             'total_books': total_books,
             'total_members': total_members,
-            'total_issued': total_issued,
-            'total_returned': total_returned,
+            'total_issued': count_by_state.get('confirmed', 0),
+            'total_returned': count_by_state.get('returned', 0) + self.env['library.issue.archive'].search_count([]),
             'most_issued_books': "\n".join(book_names),
-            'books_due_today': due_text, 
-        })
-       
-# Make sure to include display_name in the result if requested
-        if 'display_name' in fields_list:
-            res['display_name'] = f"Library Dashboard - {fields.Date.context_today(self)}"
-        
-        return res
-    
\ No newline at end of file
+            'books_due_today': due_text,
+        }
@@ -0,0 +1,139 @@
+from odoo import models, fields, api
+from collections import defaultdict
+from datetime import timedelta
+from .library_utils import get_int_param
+
+# Name of the PostgreSQL sequence used as the cache generation. Bumping a
+# sequence takes no row lock, so invalidations never make concurrent
+# checkouts wait on each other.
+GENERATION_SEQUENCE = 'library_dashboard_snapshot_generation_seq'
+
+# Hits/misses counted by this worker and not yet saved on the snapshot rows,
+# keyed by (dbname, company_id). They are flushed on the next miss, when the
+# row is locked anyway, so that a cache hit never writes to the database.
+_pending_stats = defaultdict(lambda: [0, 0])
+
+
+class LibraryDashboardSnapshot(models.Model):
+    _name = 'library.dashboard.snapshot'
+    _description = 'Library Dashboard Snapshot'
+    _rec_name = 'company_id'
+
+    company_id = fields.Many2one('res.company', string="Company", required=True, ondelete='cascade')
+    values = fields.Json(string="Dashboard Values")
+    computed_at = fields.Datetime(string="Computed At")
+    generation = fields.Integer(string="Generation")
+    hit_count = fields.Integer(string="Hits", help="Cache hits saved so far, each worker adds its own on its next miss.")
+    miss_count = fields.Integer(string="Misses")
+    hit_rate = fields.Float(string="Hit Rate (%)", compute='_compute_hit_rate')
+
+    _sql_constraints = [
+        ('company_unique', 'UNIQUE(company_id)', 'There can only be one dashboard snapshot per company!'),
+    ]
+
+    def init(self):
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {GENERATION_SEQUENCE}")
+
+    @api.depends('hit_count', 'miss_count')
+    def _compute_hit_rate(self):
+        for snapshot in self:
+            total = snapshot.hit_count + snapshot.miss_count
+            snapshot.hit_rate = 100.0 * snapshot.hit_count / total if total else 0.0
+
+    @api.model
+    def _get_ttl(self):
+        # Lifetime of a snapshot in seconds, 0 disables the cache
+        return get_int_param(self.env, 'library_management.dashboard_cache_ttl', 300)
+
+    @api.model
+    def _get_generation(self):
+        # is_called keeps the value monotonic across the very first nextval()
+        self.env.cr.execute(f"SELECT last_value + is_called::int FROM {GENERATION_SEQUENCE}")
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _get_dashboard_values(self):
+        """ Return the dashboard figures of the current company, from the
+        snapshot when it is still fresh, otherwise recomputed and saved. """
+        ttl = self._get_ttl()
+        if not ttl:
+            return self.env['library.dashboard']._get_dashboard_values()
+
+        company = self.env.company
+        snapshot = self.sudo().search([('company_id', '=', company.id)], limit=1)
+        if snapshot._is_fresh(ttl, self._get_generation()):
+            _pending_stats[self.env.cr.dbname, company.id][0] += 1
+            return snapshot.values
+        return self._refresh_snapshot(company)
+
+    def _is_fresh(self, ttl, generation):
+        if not self:
+            return False
+        self.ensure_one()
+        return bool(
+            self.values
+            and self.generation == generation
+            and self.computed_at
+            and self.computed_at + timedelta(seconds=ttl) > fields.Datetime.now()
+        )
+
+    @api.model
+    def _refresh_snapshot(self, company):
+        """ Recompute and save the snapshot of ``company``.
+
+        The snapshot row is locked first: librarians opening the dashboard at
+        the same time wait on that lock instead of recomputing the figures,
+        and their request is then retried by the server (concurrent update)
+        and served from the fresh snapshot. """
+        cr = self.env.cr
+        cr.execute(f"""
+            INSERT INTO {self._table} (company_id, hit_count, miss_count, create_uid, create_date, write_uid, write_date)
+            VALUES (%s, 0, 0, %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC')
+            ON CONFLICT (company_id) DO NOTHING
+        """, [company.id, self.env.uid, self.env.uid])
+        cr.execute(f"SELECT id FROM {self._table} WHERE company_id = %s FOR UPDATE", [company.id])
+        snapshot = self.sudo().browse(cr.fetchone()[0])
+        snapshot.invalidate_recordset()
+
+        # read the generation before computing: an invalidation committed
+        # meanwhile bumps it and makes this snapshot outdated right away
+        generation = self._get_generation()
+        values = self.env['library.dashboard'].with_company(company)._get_dashboard_values()
+
+        hits, misses = _pending_stats.pop((cr.dbname, company.id), (0, 0))
+        snapshot.write({
+            'values': values,
+            'generation': generation,
+            'computed_at': fields.Datetime.now(),
+            'hit_count': snapshot.hit_count + hits,
+            'miss_count': snapshot.miss_count + misses + 1,
+        })
+        return values
+
+    @api.model
+    def _invalidate_dashboard_cache(self):
+        """ Outdate the snapshots of all companies once the current
+        transaction is committed (at most once per transaction). """
+        postcommit = self.env.cr.postcommit
+        if postcommit.data.get('library_dashboard_invalidated'):
+            return
+        postcommit.data['library_dashboard_invalidated'] = True
+        registry = self.pool
+
+        @postcommit.add
+        def bump_generation():
+            with registry.cursor() as cr:
+                cr.execute(f"SELECT nextval('{GENERATION_SEQUENCE}')")
+
+    @api.model
+    def _cron_prewarm_snapshots(self):
+        # Recompute the outdated snapshots ahead of the librarians
+        ttl = self._get_ttl()
+        if not ttl:
+            return
+        generation = self._get_generation()
+        snapshots = self.sudo().search([])
+        for company in self.env['res.company'].sudo().search([]):
+            snapshot = snapshots.filtered(lambda s: s.company_id == company)
+            if not snapshot._is_fresh(ttl, generation):
+                self.with_company(company)._refresh_snapshot(company)
@@ -0,0 +1,65 @@
+from odoo import models, api
+from odoo.exceptions import UserError
+import logging
+from .library_utils import get_int_param
+
+_logger = logging.getLogger(__name__)
+
+# Images uploaded before their fields had a maximum size: (model, field).
+# They already were attachments, only their content is down-scaled; writing
+# a member's photo also generates its variants.
+RESIZED_IMAGE_FIELDS = [
+    ('library.member', 'photo'),
+    ('library.issue', 'signature'),
+]
+
+
+class LibraryImageMigration(models.AbstractModel):
+    """ Down-scale the images uploaded before their fields had a maximum
+    size, and generate the variants of the member photos, a batch at a time
+    rather than all of them during the module update. """
+    _name = 'library.image.migration'
+    _description = 'Library Image Migration'
+
+    @api.model
+    def _get_batch_size(self):
+        return get_int_param(self.env, 'library_management.image_migration_batch_size', 200, minimum=1)
+
+    @api.model
+    def _resize_images(self, model_name, fname, limit):
+        """ Rewrite at most ``limit`` images of the field ``fname`` of
+        ``model_name``, after the last one done by a previous run. Returns
+        the number of images rewritten and the number left. """
+        ICP = self.env['ir.config_parameter'].sudo()
+        progress_key = f'library_management.image_migration_{model_name}.{fname}'
+        last_id = get_int_param(self.env, progress_key, 0)
+        Model = self.env[model_name].with_context(tracking_disable=True)
+        domain = [('id', '>', last_id), (fname, '!=', False)]
+        record_ids = Model.search(domain, order='id', limit=limit).ids if limit > 0 else []
+        # one record at a time, only one image is ever in memory
+        for record_id in record_ids:
+            record = Model.browse(record_id)
+            try:
+                with self.env.cr.savepoint():
+                    record.write({fname: record[fname]})
+            except UserError:
+                # not a readable image: kept as is
+                _logger.warning("%s %s: %s is not a valid image, left unprocessed.", model_name, record_id, fname)
+            record.invalidate_recordset()
+        if record_ids:
+            last_id = record_ids[-1]
+            ICP.set_param(progress_key, last_id)
+        return len(record_ids), Model.search_count([('id', '>', last_id), (fname, '!=', False)])
+
+    @api.model
+    def _cron_resize_images(self):
+        """ Rewrite a batch of images, then report the progress so that the
+        cron runs again until all of them are done, and is deactivated once
+        they are: the images added since then are already resized. """
+        limit = self._get_batch_size()
+        done = remaining = 0
+        for model_name, fname in RESIZED_IMAGE_FIELDS:
+            resized, left = self._resize_images(model_name, fname, limit - done)
+            done += resized
+            remaining += left
+        self.env['ir.cron']._notify_progress(done=done, remaining=remaining, deactivate=not remaining)
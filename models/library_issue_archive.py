@@ -0,0 +1,135 @@
+from odoo import models, fields, api, tools
+from datetime import timedelta
+from .library_utils import get_int_param
+
+
+class LibraryIssueArchive(models.Model):
+    """ Returned loans moved out of library.issue by the archival cron.
+
+    The schema only keeps what the history needs: no chatter, tracking,
+    signature nor overdue fields. An archived loan keeps the id it had as an
+    issue, so both tables can be read as one (see library.loan.history). """
+    _name = 'library.issue.archive'
+    _description = 'Archived Loan'
+    _order = 'issue_date desc, id desc'
+
+    book_id = fields.Many2one('library.book', string="Book", required=True, index=True, readonly=True)
+    member_id = fields.Many2one('library.member', string="Member", required=True, index=True, readonly=True)
+    copy_id = fields.Many2one('library.book.copy', string="Copy", readonly=True, ondelete='set null')
+    issue_type = fields.Selection([
+        ('issue', 'Issue'),
+        ('purchase', 'Purchase'),
+    ], string="Request Type", readonly=True)
+    issue_date = fields.Date(string="Issue Date", readonly=True)
+    return_date = fields.Date(string="Return Date", readonly=True)
+    actual_return_date = fields.Date(string="Actual Return Date", readonly=True)
+    penalty = fields.Float(string="Penalty", readonly=True)
+    price_to_pay = fields.Float(string="Price to Pay", readonly=True)
+    payment_status = fields.Selection([
+        ('unpaid', 'Unpaid'),
+        ('paid', 'Paid'),
+    ], string="Payment Status", readonly=True)
+    payment_date = fields.Date(string="Payment Date", readonly=True)
+    archive_date = fields.Date(string="Archived On", readonly=True)
+
+    @api.depends('book_id', 'member_id')
+    def _compute_display_name(self):
+        for record in self:
+            record.display_name = f"{record.book_id.name} - {record.member_id.name}"
+
+    @api.model
+    def _get_archivable_domain(self, cutoff):
+        # loans returned before the cutoff, i.e. that are history only
+        return [
+            ('state', '=', 'returned'),
+            ('issue_type', '=', 'issue'),
+            '|', ('actual_return_date', '<', cutoff),
+                 '&', ('actual_return_date', '=', False), ('return_date', '<', cutoff),
+        ]
+
+    @api.model
+    def _archive_issues(self, issues):
+        """ Move ``issues`` to the archive with one INSERT ... SELECT, then
+        delete them along with their chatter. """
+        if not issues:
+            return
+        cr = self.env.cr
+        issues.flush_recordset()
+        cr.execute(f"""
+            INSERT INTO {self._table} (id, book_id, member_id, copy_id, issue_type, issue_date, return_date,
+                                       actual_return_date, penalty, price_to_pay, payment_status, payment_date,
+                                       archive_date, create_uid, create_date, write_uid, write_date)
+            SELECT id, book_id, member_id, copy_id, issue_type, issue_date, return_date,
+                   actual_return_date, penalty, price_to_pay, payment_status, payment_date,
+                   %s, create_uid, create_date, write_uid, write_date
+              FROM library_issue
+             WHERE id = ANY(%s)
+        """, [fields.Date.context_today(self), issues.ids])
+        # messages (their tracking values go with them) and the audit log
+        # rows of single issues are dropped in one statement each, rather
+        # than unlinked by the ORM; the rows of bulk operations stay
+        cr.execute("DELETE FROM mail_message WHERE model = 'library.issue' AND res_id = ANY(%s)", [issues.ids])
+        cr.execute("DELETE FROM library_audit_log WHERE res_model = 'library.issue' AND res_id = ANY(%s)", [issues.ids])
+        issues.with_context(tracking_disable=True).unlink()
+
+    @api.model
+    def _cron_archive_returned_loans(self):
+        """ Archive a batch of the loans returned more than the configured
+        horizon ago, then report the progress so that the cron runs again
+        until the backlog is done. """
+        horizon = get_int_param(self.env, 'library_management.archive_horizon_days', 365)
+        batch_size = get_int_param(self.env, 'library_management.archive_batch_size', 1000, minimum=1)
+        if horizon <= 0:
+            return
+        Issue = self.env['library.issue'].sudo()
+        domain = self._get_archivable_domain(fields.Date.context_today(self) - timedelta(days=horizon))
+        issues = Issue.search(domain, limit=batch_size, order='id')
+        self._archive_issues(issues)
+        self.env['ir.cron']._notify_progress(done=len(issues), remaining=Issue.search_count(domain))
+
+
+class LibraryLoanHistory(models.Model):
+    """ All the loans of the library, running and archived, as one model:
+    the history shown on books and members and used by the reports. """
+    _name = 'library.loan.history'
+    _description = 'Loan History'
+    _auto = False
+    _order = 'issue_date desc, id desc'
+
+    book_id = fields.Many2one('library.book', string="Book", readonly=True)
+    member_id = fields.Many2one('library.member', string="Member", readonly=True)
+    copy_id = fields.Many2one('library.book.copy', string="Copy", readonly=True)
+    issue_type = fields.Selection([
+        ('issue', 'Issue'),
+        ('purchase', 'Purchase'),
+    ], string="Request Type", readonly=True)
+    issue_date = fields.Date(string="Issue Date", readonly=True)
+    return_date = fields.Date(string="Return Date", readonly=True)
+    actual_return_date = fields.Date(string="Actual Return Date", readonly=True)
+    penalty = fields.Float(string="Penalty", readonly=True)
+    price_to_pay = fields.Float(string="Price to Pay", readonly=True)
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('confirmed', 'Confirmed'),
+        ('returned', 'Returned')
+    ], string="Status", readonly=True)
+    archived = fields.Boolean(string="Archived", readonly=True)
+
+    @api.depends('book_id', 'member_id')
+    def _compute_display_name(self):
+        for record in self:
+            record.display_name = f"{record.book_id.name} - {record.member_id.name}"
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                SELECT id, book_id, member_id, copy_id, issue_type, issue_date, return_date,
+                       actual_return_date, penalty, price_to_pay, state, FALSE AS archived
+                  FROM library_issue
+                 UNION ALL
+                SELECT id, book_id, member_id, copy_id, issue_type, issue_date, return_date,
+                       actual_return_date, penalty, price_to_pay, 'returned', TRUE
+                  FROM library_issue_archive
+            )
+        """)
@@ -0,0 +1,138 @@
+from odoo import models, fields, api, _
+from collections import defaultdict
+import logging
+from .library_utils import get_int_param
+
+_logger = logging.getLogger(__name__)
+
+
+class LibraryMailJob(models.Model):
+    _name = 'library.mail.job'
+    _description = 'Library Outgoing Mail Job'
+    _order = 'id desc'
+
+    template_id = fields.Many2one('mail.template', string="Template", required=True, ondelete='cascade')
+    res_model = fields.Char(string="Document Model", required=True)
+    res_id = fields.Many2oneReference(string="Document", model_field='res_model', required=True)
+    mail_id = fields.Many2one('mail.mail', string="Mail", ondelete='set null')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('queued', 'Queued'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ], string="Status", default='pending', required=True, index=True)
+    error = fields.Text(string="Error")
+    sent_date = fields.Datetime(string="Sent On")
+
+    @api.model
+    def _enqueue(self, template, records):
+        """ Queue one mail per record, rendered and sent later by the cron.
+        Returns immediately: nothing is rendered nor sent here. """
+        jobs = self.sudo().create([{
+            'template_id': template.id,
+            'res_model': records._name,
+            'res_id': record.id,
+        } for record in records])
+        self.env.ref('library_management.ir_cron_library_mail_queue')._trigger()
+        return jobs
+
+    @api.model
+    def _get_queue_settings(self):
+        return {
+            # number of mails rendered together
+            'batch_size': get_int_param(self.env, 'library_management.mail_batch_size', 50, minimum=1),
+            # max number of mails sent per cron run, the cron runs every minute
+            'rate_limit': get_int_param(self.env, 'library_management.mail_rate_limit', 200, minimum=1),
+            # optional outgoing server (e.g. the local SMTP stand-in)
+            'mail_server_id': get_int_param(self.env, 'library_management.mail_server_id', 0),
+        }
+
+    @api.model
+    def _cron_process_queue(self):
+        settings = self._get_queue_settings()
+        self._reconcile_queued_jobs()
+        # SKIP LOCKED lets several cron workers share the queue safely
+        self.env.cr.execute(f"""
+            SELECT id FROM {self._table}
+             WHERE state = 'pending'
+             ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [settings['rate_limit']])
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        for start in range(0, len(jobs), settings['batch_size']):
+            jobs[start:start + settings['batch_size']]._send_batch(settings['mail_server_id'])
+
+        remaining = self.search_count([('state', '=', 'pending')], limit=1)
+        if remaining:
+            cron = self.env.ref('library_management.ir_cron_library_mail_queue')
+            cron._trigger(fields.Datetime.add(fields.Datetime.now(), minutes=1))
+
+    def _send_batch(self, mail_server_id=False):
+        email_values = {'mail_server_id': mail_server_id} if mail_server_id else None
+        # templates are rendered as the user who queued the mail, as they
+        # use ``user`` for the sender address and the signature
+        jobs_by_template = defaultdict(lambda: self.browse())
+        for job in self:
+            jobs_by_template[job.template_id, job.create_uid] |= job
+
+        for (template, user), jobs in jobs_by_template.items():
+            try:
+                # renders all the mails of the template in one go
+                with self.env.cr.savepoint():
+                    mails = template.with_user(user).sudo().send_mail_batch(
+                        jobs.mapped('res_id'), force_send=False, email_values=email_values)
+            except Exception as e:  # noqa: BLE001 a broken template must not block the queue
+                _logger.exception("Library mail queue: rendering of template %s failed", template.id)
+                jobs.write({'state': 'failed', 'error': str(e)})
+                continue
+
+            mail_ids_by_res_id = defaultdict(list)
+            for mail in mails:
+                mail_ids_by_res_id[mail.res_id].append(mail.id)
+            mail_id_by_job = {}
+            for job in jobs:
+                if mail_ids_by_res_id[job.res_id]:
+                    mail_id_by_job[job.id] = mail_ids_by_res_id[job.res_id].pop(0)
+                    job.mail_id = mail_id_by_job[job.id]
+
+            mails.send(auto_commit=False, raise_exception=False)
+            jobs._update_state_from_mail(mail_id_by_job)
+
+    @api.model
+    def _reconcile_queued_jobs(self):
+        """ Settle the jobs whose mail was left to the standard mail queue,
+        from the current state of their mail. """
+        jobs = self.search([('state', '=', 'queued')])
+        # a mail auto-deleted once sent leaves its job without mail
+        jobs._update_state_from_mail({job.id: job.mail_id.id for job in jobs})
+
+    def _update_state_from_mail(self, mail_id_by_job):
+        """ Update the jobs from the state of their mail, with one write per
+        outcome. A job missing from ``mail_id_by_job`` got no mail at all. """
+        mails = self.env['mail.mail'].sudo().browse(
+            [mail_id for mail_id in mail_id_by_job.values() if mail_id]).exists()
+        mail_by_id = {mail.id: mail for mail in mails}
+        now = fields.Datetime.now()
+        job_ids_by_values = defaultdict(list)
+        for job in self:
+            if job.id not in mail_id_by_job:
+                values = {'state': 'failed', 'error': _("The template did not produce any mail.")}
+            else:
+                mail = mail_by_id.get(mail_id_by_job[job.id])
+                if not mail or mail.state in ('sent', 'received'):
+                    # auto-deleted templates remove their mails once sent
+                    values = {'state': 'sent', 'sent_date': now}
+                elif mail.state in ('exception', 'cancel'):
+                    values = {'state': 'failed', 'error': mail.failure_reason or False}
+                else:
+                    # still outgoing: delivered later by the standard mail queue
+                    values = {'state': 'queued'}
+            if values != {'state': job.state}:
+                job_ids_by_values[tuple(values.items())].append(job.id)
+        for values, job_ids in job_ids_by_values.items():
+            self.browse(job_ids).write(dict(values))
+
+    def action_retry(self):
+        self.filtered(lambda job: job.state == 'failed').write({'state': 'pending', 'error': False, 'mail_id': False})
+        self.env.ref('library_management.ir_cron_library_mail_queue')._trigger()
@@ -1,16 +1,21 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from collections import defaultdict
 from datetime import date
+from .library_perf import profiled
+from .library_utils import get_float_param, get_int_param
 
 class LibraryMember(models.Model):
     _name = 'library.member'
     _description = 'Library Member'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['library.audit.mixin', 'mail.thread', 'mail.activity.mixin']
 
     membership_id = fields.Char(
     string='Membership ID',
     readonly=True,
     copy=False,
     default='New',
+    index=True,
     tracking=True
     )
     
@@ -18,6 +23,7 @@ class LibraryMember(models.Model):
     middle_name = fields.Char(tracking=True)
     last_name = fields.Char(required=True, tracking=True)
     issue_ids = fields.One2many('library.issue', 'member_id', string="Issues")
+    history_ids = fields.One2many('library.loan.history', 'member_id', string="Loan History")
     dob = fields.Date(string='Date of Birth')
     age = fields.Integer(string='Age', compute='_compute_age', store=True)
 
@@ -43,7 +49,23 @@ class LibraryMember(models.Model):
     city = fields.Char(tracking=True)
     state0 = fields.Char(tracking=True)
     zip_code = fields.Char(tracking=True)
-    photo = fields.Binary(string="Photo")
+    # Photos are stored as attachments, down-scaled on upload; lists, kanban
+    # and reports load the small variants only. The variants are written
+    # along with the photo rather than computed, which would resize every
+    # photo during the module update (see library.image.migration)
+    photo = fields.Image(string="Photo", max_width=1024, max_height=1024)
+    photo_512 = fields.Image(string="Photo 512", max_width=512, max_height=512, readonly=True)
+    photo_128 = fields.Image(string="Photo 128", max_width=128, max_height=128, readonly=True)
+    last_overdue_reminder = fields.Date(string="Last Overdue Reminder", readonly=True, copy=False)
+
+    # Loan counters, kept current by library.issue and read by the checkout
+    # eligibility check without any extra query
+    active_loan_count = fields.Integer(string="Active Loans", compute='_compute_loan_counters', store=True)
+    overdue_loan_count = fields.Integer(string="Overdue Loans", compute='_compute_loan_counters', store=True)
+    outstanding_penalty = fields.Float(string="Outstanding Penalty", compute='_compute_loan_counters', store=True,
+                                       help="Unpaid penalties of returned loans and penalties accrued by overdue ones.")
+    unpaid_amount = fields.Float(string="Unpaid Amount", compute='_compute_loan_counters', store=True,
+                                 help="Prices and penalties of the unpaid issues and purchases.")
     
     state = fields.Selection([
         ('draft', 'Draft'),
@@ -52,14 +74,17 @@ class LibraryMember(models.Model):
     ], string="Status", default='draft', tracking=True)
 
     # Button actions
+    @profiled
     def action_confirm(self):
         for record in self:
             record.state = 'confirmed'
 
+    @profiled
     def action_cancel(self):
         for record in self:
             record.state = 'cancelled'
 
+    @profiled
     def action_reset_draft(self):
         for record in self:
             record.state = 'draft'
@@ -72,28 +97,189 @@ class LibraryMember(models.Model):
             
     @api.depends('dob')
     def _compute_age(self):
+        today = date.today()
         for record in self:
             if record.dob:
-                today = date.today()
                 record.age = today.year - record.dob.year - \
                              ((today.month, today.day) < (record.dob.month, record.dob.day))
             else:
                 record.age = 0        
     
+    @api.depends()
+    def _compute_loan_counters(self):
+        # three grouped queries whatever the number of members recomputed
+        counters = self._origin._get_loan_counters()
+        for member in self:
+            values = counters.get(member._origin.id, {})
+            member.active_loan_count = values.get('active', 0)
+            member.overdue_loan_count = values.get('overdue', 0)
+            member.outstanding_penalty = values.get('penalty', 0.0)
+            member.unpaid_amount = values.get('unpaid', 0.0)
+
+    def _get_loan_counters(self):
+        """ Return ``{member_id: {'active', 'overdue', 'penalty', 'unpaid'}}``
+        for the members in self, archived loans included. """
+        counters = {}
+        if not self.ids:
+            return counters
+        Issue = self.env['library.issue']
+        for member, state, issue_type, payment_status, count, penalty, accrued, price in Issue._read_group(
+                [('member_id', 'in', self.ids), ('state', '!=', 'draft')],
+                groupby=['member_id', 'state', 'issue_type', 'payment_status'],
+                aggregates=['__count', 'penalty:sum', 'accrued_penalty:sum', 'price_to_pay:sum']):
+            values = counters.setdefault(member.id, dict(active=0, overdue=0, penalty=0.0, unpaid=0.0))
+            running = state == 'confirmed' and issue_type == 'issue'
+            if running:
+                values['active'] += count
+                values['penalty'] += accrued
+            if payment_status != 'paid':
+                values['penalty'] += penalty
+                values['unpaid'] += price + penalty + (accrued if running else 0.0)
+        # overdue_days is maintained by the overdue scanner cron
+        for member, count in Issue._read_group(
+                [('member_id', 'in', self.ids), ('state', '=', 'confirmed'), ('issue_type', '=', 'issue'),
+                 ('overdue_days', '>', 0)],
+                groupby=['member_id'], aggregates=['__count']):
+            counters[member.id]['overdue'] = count
+        for member, penalty, price in self.env['library.issue.archive']._read_group(
+                [('member_id', 'in', self.ids), ('payment_status', '!=', 'paid')],
+                groupby=['member_id'], aggregates=['penalty:sum', 'price_to_pay:sum']):
+            values = counters.setdefault(member.id, dict(active=0, overdue=0, penalty=0.0, unpaid=0.0))
+            values['penalty'] += penalty
+            values['unpaid'] += price + penalty
+        return counters
+
+    def _trigger_loan_counters(self):
+        """ Mark the loan counters of these members as outdated, recomputed
+        in one batch on the next read or flush. """
+        for fname in ('active_loan_count', 'overdue_loan_count', 'outstanding_penalty', 'unpaid_amount'):
+            self.env.add_to_compute(self._fields[fname], self)
+
+    @api.model
+    def _recompute_loan_counters(self, batch_size=5000):
+        """ Repair job: rebuild the loan counters of every member, in batches. """
+        members = self.search([])
+        for start in range(0, len(members), batch_size):
+            batch = members[start:start + batch_size]
+            batch._trigger_loan_counters()
+            batch.flush_recordset(['active_loan_count', 'overdue_loan_count', 'outstanding_penalty', 'unpaid_amount'])
+            batch.invalidate_recordset()
+        return True
+
+    @api.model
+    def _get_loan_limit(self, user_type):
+        # Maximum number of running loans of a member type, 0 or no parameter
+        # for no limit; the defaults are set by data/library_config_data.xml
+        return get_int_param(self.env, f'library_management.loan_limit_{user_type or "general"}', 0)
+
     @api.model
-    def create(self, vals):
-        if vals.get('membership_id', 'New') == 'New':
-            vals['membership_id'] = self.env['ir.sequence'].next_by_code('library.member') or '/'
-        return super(LibraryMember, self).create(vals)
+    def _get_max_outstanding_penalty(self):
+        # Outstanding penalty above which loans are refused, 0 or no
+        # parameter to not check; the default is set by library_config_data.xml
+        return get_float_param(self.env, 'library_management.max_outstanding_penalty', 0.0)
 
+    def _check_loan_eligibility(self, pending_loans=0):
+        """ Raise if the member may not borrow one more book, on top of
+        ``pending_loans`` being confirmed in the same batch. Only reads the
+        member's own columns (the stored counters) and cached parameters. """
+        self.ensure_one()
+        if self.state == 'cancelled' or self.membership_status in ('inactive', 'suspended'):
+            raise UserError(_("%s's membership is not active.", self.name))
+        if self.overdue_loan_count:
+            raise UserError(_("%(member)s has %(count)s overdue loan(s) to return first.",
+                              member=self.name, count=self.overdue_loan_count))
+        max_penalty = self._get_max_outstanding_penalty()
+        if max_penalty and self.outstanding_penalty > max_penalty:
+            raise UserError(_("%(member)s has %(amount).2f of unpaid penalties (at most %(max).2f allowed).",
+                              member=self.name, amount=self.outstanding_penalty, max=max_penalty))
+        limit = self._get_loan_limit(self.user_type)
+        if limit and self.active_loan_count + pending_loans >= limit:
+            raise UserError(_("%(member)s already has %(count)s book(s) on loan, the limit is %(limit)s.",
+                              member=self.name, count=self.active_loan_count + pending_loans, limit=limit))
+
+    @api.model
+    @profiled
+    def get_loan_summary(self, membership_ids):
+        """ Loan summary of the members with these membership ids, for the
+        kiosks and the campus portal: the stored counters and the running
+        loans, read with two queries whatever the number of members. """
+        members = self.search([('membership_id', 'in', list(membership_ids))])
+        loans_by_member = defaultdict(list)
+        for loan in self.env['library.issue'].search_fetch(
+                [('member_id', 'in', members.ids), ('state', '=', 'confirmed'), ('issue_type', '=', 'issue')],
+                ['member_id', 'book_id', 'copy_id', 'issue_date', 'return_date', 'overdue_days', 'accrued_penalty'],
+                order='return_date, id'):
+            loans_by_member[loan.member_id].append({
+                'id': loan.id,
+                'isbn': loan.book_id.isbn13 or loan.book_id.isbn or None,
+                'title': loan.book_id.name,
+                'copy': loan.copy_id.barcode or None,
+                'issued': loan.issue_date,
+                'due': loan.return_date,
+                'overdue_days': loan.overdue_days,
+                'penalty': loan.accrued_penalty,
+            })
+        return [{
+            'membership_id': member.membership_id,
+            'name': member.name,
+            'status': member.membership_status,
+            'loan_limit': self._get_loan_limit(member.user_type),
+            'active_loans': member.active_loan_count,
+            'overdue_loans': member.overdue_loan_count,
+            'outstanding_penalty': member.outstanding_penalty,
+            'unpaid_amount': member.unpaid_amount,
+            'loans': loans_by_member[member],
+        } for member in members]
+
+    @api.model
+    def _add_photo_variants(self, vals):
+        # the Image fields down-scale the photo to the size of each variant
+        if 'photo' in vals:
+            vals.update(photo_512=vals['photo'], photo_128=vals['photo'])
+        return vals
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            self._add_photo_variants(vals)
+        new_vals = [vals for vals in vals_list if vals.get('membership_id', 'New') == 'New']
+        # one sequence call for the whole batch
+        for vals, membership_id in zip(new_vals, self.env['ir.sequence']._next_block_by_code('library.member', len(new_vals))):
+            vals['membership_id'] = membership_id
+        if len(vals_list) > 1:
+            # bulk creation (imports): no creation message nor follower per member
+            self = self.with_context(mail_create_nolog=True, mail_create_nosubscribe=True, tracking_disable=True)
+        records = super(LibraryMember, self).create(vals_list)
+        self.env['library.dashboard.snapshot']._invalidate_dashboard_cache()
+        return records
+
+    def write(self, vals):
+        return super().write(self._add_photo_variants(dict(vals)))
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['library.dashboard.snapshot']._invalidate_dashboard_cache()
+        return res
+
+    @profiled
     def print_issued_books_report(self):
         return self.env.ref('library_management.action_report_member_issued_books').report_action(self)
     
+    @profiled
     def action_send_welcome_email(self):
         template = self.env.ref('library_management.mail_template_library_member_welcome')
-        for member in self:
-            if member.email:
-                template.send_mail(member.id, force_send=True)
+        members = self.filtered('email')
+        # Rendered and sent in the background by the library mail queue
+        self.env['library.mail.job']._enqueue(template, members)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'message': _("%s welcome email(s) queued for sending.", len(members)),
+                'type': 'success',
+                'sticky': False,
+            },
+        }
 
 
 class ChangeStateWizard(models.TransientModel):
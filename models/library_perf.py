@@ -0,0 +1,155 @@
+from odoo import models, fields, api, tools
+from odoo.tools import str2bool
+from contextlib import contextmanager
+import functools
+import threading
+import time
+from .library_utils import get_int_param
+
+# Sequence numbering the samples, a sample overwrites the one stored
+# ``buffer_size`` samples earlier
+SAMPLE_SEQUENCE = 'library_perf_sample_slot_seq'
+
+
+@contextmanager
+def profile_operation(records, operation):
+    """ Measure the block as one call of ``operation`` on ``records``: SQL
+    queries and time, Python time and number of records, saved in
+    library.perf.sample. Costs a cached parameter lookup when disabled. """
+    Sample = records.env['library.perf.sample']
+    if not Sample._is_enabled():
+        yield
+        return
+    thread = threading.current_thread()
+    if not hasattr(thread, 'query_count'):
+        # counted by the cursor for the threads that define them (HTTP workers)
+        thread.query_count = 0
+        thread.query_time = 0
+    query_count, query_time = thread.query_count, thread.query_time
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        sql_time = thread.query_time - query_time
+        Sample._add_sample({
+            'operation': operation,
+            'record_count': len(records),
+            'query_count': thread.query_count - query_count,
+            'sql_time': sql_time * 1000,
+            'python_time': max(duration - sql_time, 0.0) * 1000,
+            'duration': duration * 1000,
+        })
+
+
+def profiled(method):
+    """ Decorator profiling each call of a model method as the operation
+    ``<model>.<method>`` (see :func:`profile_operation`). """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with profile_operation(self, f'{self._name}.{method.__name__}'):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class LibraryPerfSample(models.Model):
+    """ Ring buffer of the last profiled calls, enabled by the system
+    parameter ``library_management.perf_enabled``. """
+    _name = 'library.perf.sample'
+    _description = 'Library Performance Sample'
+    _order = 'date desc, id desc'
+    _rec_name = 'operation'
+    _log_access = False
+
+    slot = fields.Integer(string="Slot", required=True, readonly=True)
+    operation = fields.Char(string="Operation", required=True, readonly=True, index=True)
+    user_id = fields.Many2one('res.users', string="User", readonly=True, ondelete='set null')
+    date = fields.Datetime(string="Date", readonly=True)
+    record_count = fields.Integer(string="Records", readonly=True)
+    query_count = fields.Integer(string="SQL Queries", readonly=True)
+    sql_time = fields.Float(string="SQL Time (ms)", readonly=True, digits=(16, 2))
+    python_time = fields.Float(string="Python Time (ms)", readonly=True, digits=(16, 2))
+    duration = fields.Float(string="Duration (ms)", readonly=True, digits=(16, 2))
+
+    _sql_constraints = [
+        ('slot_unique', 'UNIQUE(slot)', 'A ring buffer slot holds a single sample!'),
+    ]
+
+    def init(self):
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {SAMPLE_SEQUENCE}")
+
+    @api.model
+    def _is_enabled(self):
+        return str2bool(self.env['ir.config_parameter'].sudo().get_param('library_management.perf_enabled', 'False'))
+
+    @api.model
+    def _get_buffer_size(self):
+        return get_int_param(self.env, 'library_management.perf_buffer_size', 10000, minimum=1)
+
+    @api.model
+    def _add_sample(self, vals):
+        """ Queue a sample, saved by a separate cursor once the transaction
+        is committed so that the profiled transaction is not slowed down. """
+        postcommit = self.env.cr.postcommit
+        samples = postcommit.data.get('library_perf_samples')
+        if samples is None:
+            samples = postcommit.data['library_perf_samples'] = []
+            registry, table, buffer_size = self.pool, self._table, self._get_buffer_size()
+
+            @postcommit.add
+            def save_samples():
+                with registry.cursor() as cr:
+                    for sample in samples:
+                        cr.execute(f"""
+                            INSERT INTO {table} (slot, operation, user_id, date, record_count,
+                                                 query_count, sql_time, python_time, duration)
+                            VALUES (nextval('{SAMPLE_SEQUENCE}') %% %(buffer_size)s, %(operation)s, %(user_id)s,
+                                    NOW() AT TIME ZONE 'UTC', %(record_count)s, %(query_count)s,
+                                    %(sql_time)s, %(python_time)s, %(duration)s)
+                            ON CONFLICT (slot) DO UPDATE
+                               SET operation = EXCLUDED.operation, user_id = EXCLUDED.user_id,
+                                   date = EXCLUDED.date, record_count = EXCLUDED.record_count,
+                                   query_count = EXCLUDED.query_count, sql_time = EXCLUDED.sql_time,
+                                   python_time = EXCLUDED.python_time, duration = EXCLUDED.duration
+                        """, dict(sample, buffer_size=buffer_size))
+        samples.append(dict(vals, user_id=self.env.uid))
+
+
+class LibraryPerfStat(models.Model):
+    """ Latency percentiles per operation over the samples of the buffer. """
+    _name = 'library.perf.stat'
+    _description = 'Library Performance Statistics'
+    _auto = False
+    _order = 'p95_duration desc'
+    _rec_name = 'operation'
+
+    operation = fields.Char(string="Operation", readonly=True)
+    call_count = fields.Integer(string="Calls", readonly=True)
+    avg_record_count = fields.Float(string="Avg Records", readonly=True, aggregator='avg', digits=(16, 1))
+    p50_query_count = fields.Float(string="p50 Queries", readonly=True, aggregator='max', digits=(16, 1))
+    p95_query_count = fields.Float(string="p95 Queries", readonly=True, aggregator='max', digits=(16, 1))
+    avg_sql_time = fields.Float(string="Avg SQL (ms)", readonly=True, aggregator='avg', digits=(16, 2))
+    avg_python_time = fields.Float(string="Avg Python (ms)", readonly=True, aggregator='avg', digits=(16, 2))
+    p50_duration = fields.Float(string="p50 (ms)", readonly=True, aggregator='max', digits=(16, 2))
+    p95_duration = fields.Float(string="p95 (ms)", readonly=True, aggregator='max', digits=(16, 2))
+    max_duration = fields.Float(string="Max (ms)", readonly=True, aggregator='max', digits=(16, 2))
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                SELECT ROW_NUMBER() OVER (ORDER BY operation) AS id,
+                       operation,
+                       COUNT(*) AS call_count,
+                       AVG(record_count) AS avg_record_count,
+                       PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY query_count) AS p50_query_count,
+                       PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY query_count) AS p95_query_count,
+                       AVG(sql_time) AS avg_sql_time,
+                       AVG(python_time) AS avg_python_time,
+                       PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY duration) AS p50_duration,
+                       PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY duration) AS p95_duration,
+                       MAX(duration) AS max_duration
+                  FROM library_perf_sample
+                 GROUP BY operation
+            )
+        """)
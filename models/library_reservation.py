@@ -0,0 +1,183 @@
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools.sql import create_index
+from collections import defaultdict
+from datetime import timedelta
+from .library_perf import profiled
+from .library_utils import get_int_param
+
+# Rank in the waiting queue of each member type, lower comes first
+RESERVATION_PRIORITY = {'faculty': 1, 'student': 2, 'general': 3}
+DEFAULT_PRIORITY = 3
+
+# States in which a reservation holds a place in the queue or a copy
+ACTIVE_STATES = ('waiting', 'held')
+
+
+class LibraryReservation(models.Model):
+    """ Waiting list of a book. Each copy freed by a return (or added to the
+    stock) is held for the first reservation of the queue, ordered by member
+    type then request time, until the member checks it out or the hold
+    expires. """
+    _name = 'library.reservation'
+    _description = 'Library Reservation'
+    _order = 'priority, request_date, id'
+
+    book_id = fields.Many2one('library.book', string="Book", required=True, ondelete='cascade')
+    member_id = fields.Many2one('library.member', string="Member", required=True, index=True, ondelete='cascade')
+    priority = fields.Integer(string="Priority", compute='_compute_priority', store=True,
+                              help="Rank of the member type in the queue, lower comes first.")
+    request_date = fields.Datetime(string="Requested On", default=fields.Datetime.now, required=True, readonly=True)
+    state = fields.Selection([
+        ('waiting', 'Waiting'),
+        ('held', 'Held'),
+        ('fulfilled', 'Fulfilled'),
+        ('expired', 'Expired'),
+        ('cancelled', 'Cancelled'),
+    ], string="Status", default='waiting', required=True, readonly=True)
+    copy_id = fields.Many2one('library.book.copy', string="Held Copy", readonly=True, ondelete='set null')
+    hold_expiry = fields.Datetime(string="Held Until", readonly=True)
+    issue_id = fields.Many2one('library.issue', string="Loan", readonly=True, ondelete='set null')
+
+    def init(self):
+        # the head of a book's queue is the first entry of this small index
+        create_index(self.env.cr, 'library_reservation_queue_index', self._table,
+                     ['book_id', 'priority', 'request_date', 'id'], where="state = 'waiting'")
+
+    @api.depends('member_id.user_type')
+    def _compute_priority(self):
+        for reservation in self:
+            reservation.priority = RESERVATION_PRIORITY.get(reservation.member_id.user_type, DEFAULT_PRIORITY)
+
+    @api.constrains('book_id', 'member_id', 'state')
+    def _check_single_reservation(self):
+        for reservation in self.filtered(lambda r: r.state in ACTIVE_STATES):
+            if self.search_count([
+                ('id', '!=', reservation.id),
+                ('book_id', '=', reservation.book_id.id),
+                ('member_id', '=', reservation.member_id.id),
+                ('state', 'in', ACTIVE_STATES),
+            ], limit=1):
+                raise ValidationError(_("%(member)s has already reserved '%(book)s'.",
+                                        member=reservation.member_id.name, book=reservation.book_id.name))
+
+    @api.model
+    def _get_hold_days(self):
+        return get_int_param(self.env, 'library_management.reservation_hold_days', 3, minimum=1)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        reservations = super().create(vals_list)
+        # a copy on the shelf is held right away
+        Copy = self.env['library.book.copy']
+        held = self.browse()
+        for reservation in reservations:
+            copy = Copy._claim(reservation.book_id, reservation, 'reserved')
+            if copy:
+                held |= reservation
+        held._hold()
+        return reservations
+
+    @api.model
+    def _get_hold_expiry(self):
+        return fields.Datetime.now() + timedelta(days=self._get_hold_days())
+
+    def _hold(self):
+        if not self:
+            return
+        self.write({'state': 'held', 'hold_expiry': self._get_hold_expiry()})
+        self._notify_hold()
+
+    def _notify_hold(self):
+        # the copies held are no longer available, their members are told
+        if not self:
+            return
+        self.book_id._trigger_issue_counters()
+        template = self.env.ref('library_management.mail_template_library_reservation_ready')
+        self.env['library.mail.job']._enqueue(template, self.filtered('member_id.email'))
+
+    @api.model
+    def _allocate(self, copies):
+        """ Hold each copy of ``copies``, just back on the shelf, for the head
+        of the queue of its book. Returns the reservations served.
+
+        The head is found through the queue index and taken with SKIP LOCKED:
+        concurrent returns of the same book serve distinct reservations, and
+        a copy is only available to walk-in checkouts once the queue is
+        empty. The head is held by the same statement, so that it leaves the
+        queue at once: SKIP LOCKED does not skip the rows locked by the
+        current transaction, the next copy of the batch would get it too. """
+        self.flush_model()
+        served = self.browse()
+        hold_expiry = self._get_hold_expiry()
+        for copy in copies.filtered(lambda c: c.status == 'available'):
+            self.env.cr.execute(f"""
+                UPDATE {self._table}
+                   SET state = 'held', copy_id = %s, hold_expiry = %s,
+                       write_uid = %s, write_date = NOW() AT TIME ZONE 'UTC'
+                 WHERE id = (
+                        SELECT id FROM {self._table}
+                         WHERE book_id = %s AND state = 'waiting' AND copy_id IS NULL
+                         ORDER BY priority, request_date, id
+                         LIMIT 1
+                           FOR UPDATE SKIP LOCKED
+                 )
+             RETURNING id
+            """, [copy.id, hold_expiry, self.env.uid, copy.book_id.id])
+            row = self.env.cr.fetchone()
+            if row:
+                served |= self.browse(row[0])
+                copy.status = 'reserved'
+        served.invalidate_recordset(['state', 'copy_id', 'hold_expiry', 'write_uid', 'write_date'])
+        served._notify_hold()
+        return served
+
+    @profiled
+    def action_checkout(self):
+        """ Lend their held copy to the members of these reservations. """
+        if any(reservation.state != 'held' for reservation in self):
+            raise UserError(_("Only reservations holding a copy can be checked out."))
+        pending_loans = defaultdict(int)
+        for reservation in self:
+            reservation.member_id._check_loan_eligibility(pending_loans[reservation.member_id])
+            pending_loans[reservation.member_id] += 1
+        today = fields.Date.context_today(self)
+        issues = self.env['library.issue'].create([{
+            'book_id': reservation.book_id.id,
+            'member_id': reservation.member_id.id,
+            'issue_type': 'issue',
+            'issue_date': today,
+            'return_date': today + timedelta(days=14),
+        } for reservation in self])
+        self.copy_id.write({'status': 'loaned'})
+        for reservation, issue in zip(self, issues):
+            issue.copy_id = reservation.copy_id
+            reservation.issue_id = issue
+        issues.write({'state': 'confirmed'})
+        self.write({'state': 'fulfilled'})
+        self.book_id._trigger_issue_counters()
+        if len(issues) == 1:
+            return {
+                'type': 'ir.actions.act_window',
+                'res_model': 'library.issue',
+                'res_id': issues.id,
+                'view_mode': 'form',
+            }
+        return True
+
+    @profiled
+    def action_cancel(self):
+        self._end('cancelled')
+
+    def _end(self, state):
+        """ Close these reservations; their held copies go to the next ones. """
+        active = self.filtered(lambda r: r.state in ACTIVE_STATES)
+        copies = active.copy_id
+        active.write({'state': state, 'copy_id': False})
+        active.book_id._trigger_issue_counters()
+        copies._release()
+
+    @api.model
+    def _cron_expire_holds(self):
+        expired = self.search([('state', '=', 'held'), ('hold_expiry', '<', fields.Datetime.now())])
+        expired._end('expired')
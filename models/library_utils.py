@@ -0,0 +1,16 @@
+def get_int_param(env, key, default, minimum=0):
+    """ Integer value of the system parameter ``key``, at least ``minimum``;
+    ``default`` when the parameter is missing, blank or not a number, so
+    that a mistyped setting never breaks the code reading it. """
+    try:
+        return max(int(env['ir.config_parameter'].sudo().get_param(key, default)), minimum)
+    except (TypeError, ValueError):
+        return default
+
+
+def get_float_param(env, key, default, minimum=0.0):
+    """ Float counterpart of :func:`get_int_param`. """
+    try:
+        return max(float(env['ir.config_parameter'].sudo().get_param(key, default)), minimum)
+    except (TypeError, ValueError):
+        return default
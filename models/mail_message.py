@@ -0,0 +1,21 @@
+from odoo import models, api
+
+
+class MailMessage(models.Model):
+    _inherit = 'mail.message'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        messages = super().create(vals_list)
+        self.env['library.mail.usage']._count('message_count', len(messages))
+        return messages
+
+
+class MailTrackingValue(models.Model):
+    _inherit = 'mail.tracking.value'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        trackings = super().create(vals_list)
+        self.env['library.mail.usage']._count('tracking_count', len(trackings))
+        return trackings
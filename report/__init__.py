@@ -0,0 +1 @@
+from . import library_reports
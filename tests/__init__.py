@@ -0,0 +1,12 @@
+from . import test_audit
+from . import test_benchmarks
+from . import test_book
+from . import test_book_export
+from . import test_catalogue_search
+from . import test_circulation_stats
+from . import test_concurrency
+from . import test_issue
+from . import test_mail_job
+from . import test_member_photo
+from . import test_query_counts
+from . import test_reservation
@@ -0,0 +1,431 @@
+import base64
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from PIL import Image
+from psycopg2 import errors
+
+from odoo import SUPERUSER_ID, api, fields
+from odoo.modules.registry import Registry
+from odoo.tests.common import BaseCase, TransactionCase, get_db_name
+
+_logger = logging.getLogger(__name__)
+
+# Synthetic books get ISBNs under the 979-0 prefix, which is reserved for
+# printed music (ISMN) and so never clashes with a real book
+SYNTHETIC_ISBN_PREFIX = '9790'
+
+FIRST_NAMES = ['Aarav', 'Ananya', 'Arjun', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Nikhil', 'Priya', 'Rahul',
+               'Riya', 'Rohan', 'Saanvi', 'Sanjay', 'Sneha', 'Tara', 'Varun', 'Vihaan', 'Zara', 'Aditi']
+LAST_NAMES = ['Agarwal', 'Bose', 'Chopra', 'Das', 'Desai', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Khan',
+              'Kumar', 'Mehta', 'Nair', 'Patel', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Verma']
+TITLE_WORDS = ['Silent', 'River', 'Empire', 'Garden', 'Shadow', 'Light', 'Journey', 'Ocean', 'Memory', 'Stone',
+               'Secret', 'Winter', 'City', 'Star', 'Forest', 'Letters', 'Storm', 'Kingdom', 'Dream', 'Fire']
+CITIES = ['Ahmedabad', 'Bengaluru', 'Chennai', 'Delhi', 'Hyderabad', 'Kolkata', 'Mumbai', 'Pune', 'Surat']
+
+# (value, weight) of the generated distributions
+CATEGORY_WEIGHTS = [('fiction', 35), ('nonfiction', 20), ('sci_fi', 15), ('history', 12),
+                    ('biography', 10), ('other', 8)]
+USER_TYPE_WEIGHTS = [('student', 60), ('general', 30), ('faculty', 10)]
+COPIES_WEIGHTS = [(1, 30), (2, 25), (3, 20), (5, 15), (10, 10)]
+
+# Share of purchases among the requests, of drafts, and of the loans older
+# than their due date still not returned (overdue)
+PURCHASE_RATE = 0.05
+DRAFT_RATE = 0.01
+OVERDUE_RATE = 0.03
+# Period covered by the generated loans
+HISTORY_DAYS = 730
+# Size of the generated member photos, as taken by a phone, and number of
+# distinct pictures shared by the members
+PHOTO_SIZE = (1200, 1600)
+PHOTO_COUNT = 10
+# Records on a page of the kanban view
+KANBAN_PAGE_SIZE = 40
+# Errors of a transaction that lost a race, retried as the RPC layer does
+CONCURRENCY_ERRORS = (errors.SerializationFailure, errors.DeadlockDetected, errors.LockNotAvailable)
+CONCURRENCY_RETRIES = 5
+
+
+def _weighted(rng, weights):
+    return rng.choices([value for value, _weight in weights], [weight for _value, weight in weights])[0]
+
+
+def _isbn13(number):
+    body = f'{SYNTHETIC_ISBN_PREFIX}{number:08d}'
+    check = (10 - sum((3 if i % 2 else 1) * int(c) for i, c in enumerate(body)) % 10) % 10
+    return body + str(check)
+
+
+class LibraryDataGenerator:
+    """ Production-scale synthetic data for the benchmarks: books with their
+    copies, members and issues with realistic state and date distributions.
+
+    The rows are inserted with batched SQL, one INSERT from column arrays
+    per batch, so that a million issues load in minutes; the data is the
+    same for the same seed and database. """
+
+    def __init__(self, env, seed=42, batch_size=50000):
+        self.env = env
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+
+    def _bulk_insert(self, table, columns, rows, batch_size):
+        """ Insert ``rows`` (tuples of the values of ``columns``, a list of
+        ``(name, sql_type)``) by batches, each one a single INSERT from
+        column arrays. Returns the new ids, in the order of ``rows``. """
+        names = ", ".join(name for name, _type in columns)
+        arrays = ", ".join(f"%s::{sql_type}[]" for _name, sql_type in columns)
+        query = f"""
+            INSERT INTO {table} ({names}, create_uid, create_date, write_uid, write_date)
+            SELECT *, %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC'
+              FROM unnest({arrays})
+            RETURNING id
+        """
+        ids = []
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            self.env.cr.execute(query, [list(values) for values in zip(*chunk)] + [self.env.uid, self.env.uid])
+            ids += [row[0] for row in self.env.cr.fetchall()]
+        return ids
+
+    def generate(self, books=1000, members=1000, issues=10000, photos=0):
+        """ Add ``books`` books with their copies, ``members`` members and
+        ``issues`` issue requests spread over the last two years. ``photos``
+        of the new members get a photo. Successive calls add more data. """
+        rng, batch_size = self.rng, self.batch_size
+        today = fields.Date.context_today(self.env['library.book'])
+        start = time.time()
+        # the generated rows bypass the ORM, which must not hold stale values
+        self.env.flush_all()
+
+        book_data = self._generate_books(rng, books, today, batch_size)
+        member_data = self._generate_members(rng, members, today, batch_size)
+        nb_issues = self._generate_issues(rng, book_data, member_data, issues, today, batch_size)
+        self._generate_copies(list(book_data), batch_size)
+
+        self.env.invalidate_all()
+        self._generate_photos(rng, list(member_data), photos)
+        self.env['library.book']._recompute_issue_counters()
+        self.env['library.member']._recompute_loan_counters()
+        self.env['library.dashboard.snapshot']._invalidate_dashboard_cache()
+        result = {'books': len(book_data), 'members': len(member_data), 'issues': nb_issues,
+                  'seconds': round(time.time() - start, 1)}
+        _logger.info("Library synthetic data generated: %s", result)
+        return result
+
+    def _generate_books(self, rng, count, today, batch_size):
+        self.env.cr.execute("SELECT COUNT(*) FROM library_book WHERE isbn LIKE %s", [SYNTHETIC_ISBN_PREFIX + '%'])
+        offset = self.env.cr.fetchone()[0]
+        rows = []
+        for number in range(offset, offset + count):
+            isbn = _isbn13(number)
+            copies = _weighted(rng, COPIES_WEIGHTS)
+            issue_price = rng.choice([10.0, 20.0, 30.0, 50.0])
+            rows.append((
+                f"{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} {number + 1}",
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                isbn, isbn,
+                today - timedelta(days=rng.randint(0, 70 * 365)),
+                copies, copies, True,
+                issue_price * 20, issue_price,
+                _weighted(rng, CATEGORY_WEIGHTS),
+                0,
+            ))
+        ids = self._bulk_insert('library_book', [
+            ('name', 'varchar'), ('author', 'varchar'), ('isbn', 'varchar'), ('isbn13', 'varchar'),
+            ('publication_date', 'date'), ('num_copies', 'int'), ('available_copies', 'int'), ('available', 'bool'),
+            ('purchase_price', 'float8'), ('issue_price', 'float8'), ('category', 'varchar'), ('times_issued', 'int'),
+        ], rows, batch_size)
+        # {id: (name, num_copies, purchase_price, issue_price)} for the issues
+        return {book_id: (row[0], row[5], row[8], row[9]) for book_id, row in zip(ids, rows)}
+
+    def _generate_members(self, rng, count, today, batch_size):
+        membership_ids = self.env['ir.sequence']._next_block_by_code('library.member', count)
+        rows = []
+        for number, membership_id in enumerate(membership_ids):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            user_type = _weighted(rng, USER_TYPE_WEIGHTS)
+            age = rng.randint(17, 25) if user_type == 'student' else rng.randint(26, 75)
+            rows.append((
+                membership_id, first_name, last_name, f"{first_name} {last_name}",
+                today - timedelta(days=age * 365 + rng.randint(0, 364)), age,
+                f"{first_name}.{last_name}.{membership_id.replace('/', '')}@example.com".lower(),
+                f"+91 9{rng.randint(0, 999999999):09d}",
+                today - timedelta(days=rng.randint(0, 5 * 365)),
+                'active' if rng.random() < 0.95 else 'inactive',
+                user_type, 'confirmed', rng.choice(CITIES),
+            ))
+        ids = self._bulk_insert('library_member', [
+            ('membership_id', 'varchar'), ('first_name', 'varchar'), ('last_name', 'varchar'), ('name', 'varchar'),
+            ('dob', 'date'), ('age', 'int'), ('email', 'varchar'), ('phone', 'varchar'), ('date_joined', 'date'),
+            ('membership_status', 'varchar'), ('user_type', 'varchar'), ('state', 'varchar'), ('city', 'varchar'),
+        ], rows, batch_size)
+        return {member_id: row[3] for member_id, row in zip(ids, rows)}
+
+    def _generate_issues(self, rng, book_data, member_data, count, today, batch_size):
+        """ Loans are mostly returned, with some overdue ones; the loans of
+        the last two weeks are still running. A book is never lent more
+        copies than it has. """
+        penalty_per_day = self.env['library.issue']._get_penalty_per_day()
+        book_ids, member_ids = list(book_data), list(member_data)
+        loaned = dict.fromkeys(book_ids, 0)
+        columns = [
+            ('display_name', 'varchar'), ('book_id', 'int'), ('member_id', 'int'), ('issue_type', 'varchar'),
+            ('state', 'varchar'), ('issue_date', 'date'), ('return_date', 'date'), ('actual_return_date', 'date'),
+            ('penalty', 'float8'), ('price_to_pay', 'float8'), ('payment_status', 'varchar'), ('payment_date', 'date'),
+        ]
+        for start in range(0, count, batch_size):
+            rows = []
+            for _i in range(start, min(start + batch_size, count)):
+                book_id, member_id = rng.choice(book_ids), rng.choice(member_ids)
+                book_name, num_copies, purchase_price, issue_price = book_data[book_id]
+                issue_date = today - timedelta(days=int(rng.triangular(0, HISTORY_DAYS, 0)))
+                display_name = f"{book_name} - {member_data[member_id]}"
+                if rng.random() < PURCHASE_RATE:
+                    rows.append((display_name, book_id, member_id, 'purchase', 'confirmed', issue_date, None, None,
+                                 0.0, purchase_price, 'paid', issue_date))
+                    continue
+                return_date = issue_date + timedelta(days=14)
+                if rng.random() < DRAFT_RATE:
+                    state = 'draft'
+                elif return_date >= today or rng.random() < OVERDUE_RATE:
+                    state = 'confirmed'
+                else:
+                    state = 'returned'
+                if state == 'confirmed':
+                    if loaned[book_id] < num_copies:
+                        loaned[book_id] += 1
+                    else:
+                        state = 'returned'
+                actual_return_date, penalty = None, 0.0
+                if state == 'returned':
+                    actual_return_date = min(issue_date + timedelta(days=rng.randint(1, 21)), today)
+                    penalty = max((actual_return_date - return_date).days, 0) * penalty_per_day
+                rows.append((display_name, book_id, member_id, 'issue', state, issue_date, return_date,
+                             actual_return_date, penalty, issue_price,
+                             'paid' if state == 'returned' else 'unpaid',
+                             actual_return_date if state == 'returned' else None))
+            self._bulk_insert('library_issue', columns, rows, batch_size)
+        return count
+
+    def _generate_photos(self, rng, member_ids, count):
+        """ Give a photo to ``count`` of the members: a large JPEG uploaded
+        through the ORM, which down-scales it and generates its variants. """
+        if not count:
+            return
+        pictures = []
+        for _i in range(PHOTO_COUNT):
+            # noise does not compress, as much as a real photo
+            image = Image.merge('RGB', [Image.effect_noise(PHOTO_SIZE, rng.randint(20, 60)) for _band in 'RGB'])
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=90)
+            pictures.append(base64.b64encode(buffer.getvalue()))
+        Member = self.env['library.member'].with_context(tracking_disable=True)
+        for member_id in rng.sample(member_ids, min(count, len(member_ids))):
+            Member.browse(member_id).write({'photo': rng.choice(pictures)})
+
+    def _generate_copies(self, book_ids, batch_size):
+        """ Create the copies of the generated books, then give one to each
+        running loan of these books. """
+        cr = self.env.cr
+        cr.execute("SELECT id, num_copies FROM library_book WHERE id = ANY(%s) ORDER BY id", [book_ids])
+        copies = [book_id for book_id, num_copies in cr.fetchall() for _i in range(num_copies)]
+        if not copies:
+            return
+        barcodes = self.env['ir.sequence']._next_block_by_code('library.book.copy', len(copies))
+        self._bulk_insert('library_book_copy', [('book_id', 'int'), ('barcode', 'varchar'), ('status', 'varchar')],
+                          [(book_id, barcode, 'available') for book_id, barcode in zip(copies, barcodes)], batch_size)
+        cr.execute("""
+            WITH loans AS (
+                SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS rank
+                  FROM library_issue
+                 WHERE book_id = ANY(%(book_ids)s) AND state = 'confirmed' AND issue_type = 'issue'
+            ), copies AS (
+                SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS rank
+                  FROM library_book_copy
+                 WHERE book_id = ANY(%(book_ids)s) AND status = 'available'
+            ), linked AS (
+                UPDATE library_issue i
+                   SET copy_id = c.id
+                  FROM loans l
+                  JOIN copies c ON c.book_id = l.book_id AND c.rank = l.rank
+                 WHERE i.id = l.id
+             RETURNING c.id
+            )
+            UPDATE library_book_copy SET status = 'loaned' WHERE id IN (SELECT id FROM linked)
+        """, {'book_ids': book_ids})
+
+
+def get_benchmark_sizes(default):
+    """ Sizes the benchmarks run at: ``default``, or the comma-separated
+    sizes of the ``LIBRARY_BENCHMARK_SIZES`` environment variable (e.g.
+    ``10000,100000,1000000`` for production-scale runs). """
+    sizes = os.environ.get('LIBRARY_BENCHMARK_SIZES')
+    return [int(size) for size in sizes.split(',')] if sizes else list(default)
+
+
+class LibraryBenchmarkCase(TransactionCase):
+    """ Base of the benchmarks: each one is timed and its queries counted on
+    a cold cache, and the results of a test class are written as JSON to
+    ``library_benchmark_<class>.json`` in the ``LIBRARY_BENCHMARK_DIR``
+    directory (the temporary directory by default), so that versions can be
+    compared. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = []
+        cls.generator = LibraryDataGenerator(cls.env)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._write_report()
+        super().tearDownClass()
+
+    @classmethod
+    def _write_report(cls):
+        if not cls.results:
+            return
+        module = cls.env['ir.module.module'].search([('name', '=', 'library_management')])
+        cls.env.cr.execute("""
+            SELECT (SELECT COUNT(*) FROM library_book), (SELECT COUNT(*) FROM library_member),
+                   (SELECT COUNT(*) FROM library_issue), (SELECT COUNT(*) FROM library_issue_archive)
+        """)
+        books, members, issues, archived = cls.env.cr.fetchone()
+        output = json.dumps({
+            'module_version': module.latest_version,
+            'date': fields.Datetime.to_string(fields.Datetime.now()),
+            'database': {'books': books, 'members': members, 'issues': issues, 'archived_issues': archived},
+            'results': cls.results,
+        }, indent=2)
+        directory = os.environ.get('LIBRARY_BENCHMARK_DIR') or tempfile.gettempdir()
+        path = os.path.join(directory, f'library_benchmark_{cls.__name__}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(output)
+        _logger.info("Library benchmarks written to %s:\n%s", path, output)
+
+    def setUp(self):
+        super().setUp()
+        self.generated_issues = 0
+
+    def grow_to(self, issues):
+        """ Generate data until this test generated ``issues`` issues, with
+        a book per ten issues and a member per twenty. """
+        missing = issues - self.generated_issues
+        if missing > 0:
+            self.generator.generate(books=max(missing // 10, 1), members=max(missing // 20, 1), issues=missing)
+            self.generated_issues = issues
+
+    def bench(self, name, function, records, **extra):
+        """ Time ``function`` and count its queries on a cold cache, record
+        the result under ``name`` and return it. """
+        self.env.flush_all()
+        self.env.invalidate_all()
+        query_count = self.cr.sql_log_count
+        start = time.perf_counter()
+        function()
+        self.env.flush_all()
+        duration = time.perf_counter() - start
+        result = dict({
+            'name': name,
+            'records': records,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': self.cr.sql_log_count - query_count,
+        }, **extra)
+        self.results.append(result)
+        _logger.info("Library benchmark %s", result)
+        return result
+
+
+class LibraryTestCommon(TransactionCase):
+    """ Small fixtures for the functional and query count tests. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['ir.config_parameter'].sudo().set_param('library_management.loan_limit_general', 0)
+
+    @classmethod
+    def _create_books(cls, count, copies=1):
+        # numbered after the books already there, so that the ISBNs are unique
+        start = cls.env['library.book'].search_count([])
+        return cls.env['library.book'].create([{
+            'name': f'Book {number}',
+            'isbn': _isbn13(90000000 + number),
+            'num_copies': copies,
+        } for number in range(start, start + count)])
+
+    @classmethod
+    def _create_members(cls, count, user_type='general'):
+        return cls.env['library.member'].create([{
+            'first_name': 'Member',
+            'last_name': str(number),
+            'user_type': user_type,
+        } for number in range(count)])
+
+
+class LibraryConcurrencyCase(BaseCase):
+    """ Base of the concurrency tests. The test cursor of TransactionCase
+    serializes everything, so the threads here each work in a real
+    transaction, on data committed beforehand and deleted afterwards. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.registry = Registry(get_db_name())
+
+    def create_committed(self, model, vals_list):
+        """ Create records in a transaction of their own, deleted at the end
+        of the test. Returns their ids. """
+        with self.registry.cursor() as cr:
+            ids = api.Environment(cr, SUPERUSER_ID, {})[model].create(vals_list).ids
+        self.addCleanup(self._unlink_committed, model, ids)
+        return ids
+
+    def _unlink_committed(self, model, ids):
+        with self.registry.cursor() as cr:
+            api.Environment(cr, SUPERUSER_ID, {})[model].browse(ids).exists().unlink()
+
+    def run_committed(self, function):
+        """ Return ``function(env)``, run and committed in a transaction of
+        its own. """
+        with self.registry.cursor() as cr:
+            return function(api.Environment(cr, SUPERUSER_ID, {}))
+
+    def run_concurrently(self, function, args_list):
+        """ Call ``function(env, *args)`` for each ``args`` of ``args_list``,
+        each in its own thread and transaction, all started at once. Returns
+        the exception raised by each call, or None when it committed. """
+        barrier = threading.Barrier(len(args_list))
+        results = [None] * len(args_list)
+
+        def run(index, args):
+            for attempt in range(CONCURRENCY_RETRIES):
+                try:
+                    with self.registry.cursor() as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+                        if not attempt:
+                            barrier.wait(timeout=60)
+                        function(env, *args)
+                    results[index] = None
+                    return
+                except CONCURRENCY_ERRORS as e:
+                    results[index] = e
+                except Exception as e:  # noqa: BLE001 reported to the test
+                    results[index] = e
+                    return
+
+        threads = [threading.Thread(target=run, args=(index, args)) for index, args in enumerate(args_list)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,25 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestAudit(LibraryTestCommon):
+
+    def test_compact_mode_coalesces_batches(self):
+        self.env['ir.config_parameter'].sudo().set_param('library_management.audit_mode', 'compact')
+        books = self._create_books(5)
+        member = self._create_members(1)
+        issues = self.env['library.issue'].create([{
+            'book_id': book.id,
+            'member_id': member.id,
+            'issue_type': 'issue',
+        } for book in books])
+        issues.action_confirm()
+
+        Log = self.env['library.audit.log']
+        logs = Log.search([('res_model', '=', 'library.issue'), ('operation', '=', 'confirm')])
+        self.assertEqual(len(logs), 1, "A bulk confirmation is logged as one row")
+        self.assertEqual(logs.res_ids, issues.ids)
+        self.assertFalse(logs.res_id)
+        self.assertEqual(len(logs.body.splitlines()), len(issues))
@@ -0,0 +1,370 @@
+import io
+import json
+import time
+
+from odoo import fields
+from odoo.tests import HttpCase, tagged
+
+from ..controllers.api import API_ROOT
+from .common import KANBAN_PAGE_SIZE, LibraryBenchmarkCase, get_benchmark_sizes, TITLE_WORDS
+
+# Records handled by the benchmarks of a bulk operation or a report
+SAMPLE_SIZE = 100
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestLibraryBenchmarks(LibraryBenchmarkCase):
+    """ Benchmark suite of the main library operations, over generated data
+    of the largest benchmark size (10,000 issues by default). """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        issues = get_benchmark_sizes([10000])[-1]
+        cls.generator.generate(books=max(issues // 10, 1), members=max(issues // 20, 1), issues=issues)
+
+    def _get_eligible_members(self, limit):
+        return self.env['library.member'].search([
+            ('state', '!=', 'cancelled'),
+            ('membership_status', '=', 'active'),
+            ('active_loan_count', '=', 0),
+            ('overdue_loan_count', '=', 0),
+            ('outstanding_penalty', '=', 0),
+        ], limit=limit)
+
+    def test_dashboard_compute(self):
+        self.bench('dashboard_compute', self.env['library.dashboard']._get_dashboard_values, 1)
+
+    def test_dashboard_cached(self):
+        Snapshot = self.env['library.dashboard.snapshot']
+        Snapshot._get_dashboard_values()
+        self.bench('dashboard_cached', Snapshot._get_dashboard_values, 1)
+
+    def test_book_list(self):
+        Book = self.env['library.book']
+        fnames = ['name', 'author', 'isbn', 'num_copies', 'available_copies', 'category']
+        self.bench('book_list', lambda: Book.search_read([], fnames, limit=80), 80)
+
+    def test_catalogue_search(self):
+        Book = self.env['library.book']
+        self.bench('catalogue_search', lambda: Book.search_catalogue(TITLE_WORDS[0], limit=SAMPLE_SIZE), SAMPLE_SIZE)
+
+    def test_bulk_confirm(self):
+        books = self.env['library.book'].search([('available_copies', '>', 0)], limit=SAMPLE_SIZE)
+        members = self._get_eligible_members(SAMPLE_SIZE)
+        issues = self.env['library.issue'].create([{
+            'book_id': book.id,
+            'member_id': member.id,
+            'issue_type': 'issue',
+        } for book, member in zip(books, members)])
+        self.bench('bulk_confirm', issues.action_confirm, len(issues))
+        self.assertEqual(set(issues.mapped('state')), {'confirmed'})
+
+    def test_bulk_return(self):
+        issues = self.env['library.issue'].search(
+            [('state', '=', 'confirmed'), ('issue_type', '=', 'issue')], limit=SAMPLE_SIZE)
+        self.bench('bulk_return', issues.action_bulk_return, len(issues))
+        self.assertEqual(set(issues.mapped('state')), {'returned'})
+
+    def test_report_book_issued_users(self):
+        books = self.env['library.book'].search([('times_issued', '>', 0)], limit=SAMPLE_SIZE)
+        Report = self.env['ir.actions.report']
+        self.bench('report_book_issued_users', lambda: Report._render_qweb_html(
+            'library_management.action_report_book_issued_users', books.ids), len(books))
+
+    def test_report_member_issued_books(self):
+        members = self.env['library.member'].search([], limit=SAMPLE_SIZE)
+        Report = self.env['ir.actions.report']
+        self.bench('report_member_issued_books', lambda: Report._render_qweb_html(
+            'library_management.action_report_member_issued_books', members.ids), len(members))
+
+    def test_export_books(self):
+        export = self.env['library.book.export'].create({'domain': '[]'})
+        self.bench('export_books', lambda: export._write_xlsx(io.BytesIO()), self.env['library.book'].search_count([]))
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestBookListScaling(LibraryBenchmarkCase):
+    """ Query count of the book list view, availability counters included,
+    as the catalogue and the page grow: it must not depend on either. """
+
+    LIST_SPECIFICATION = dict.fromkeys(
+        ['name', 'author', 'isbn', 'num_copies', 'available_copies', 'times_issued', 'category'], {})
+
+    def test_book_list_scaling(self):
+        Book = self.env['library.book']
+        page_queries, full_queries = set(), set()
+        books = 0
+        for size in get_benchmark_sizes([100, 1000]):
+            self.generator.generate(books=size - books, members=max((size - books) // 10, 1), issues=(size - books) * 5)
+            books = size
+            # a page of the list view, and the largest page the client loads at once
+            page_queries.add(self.bench('book_list_page', lambda: Book.web_search_read(
+                [], self.LIST_SPECIFICATION, limit=80), 80, catalogue=size)['queries'])
+            limit = min(size, 1000)
+            full_queries.add(self.bench('book_list_full', lambda: Book.web_search_read(
+                [], self.LIST_SPECIFICATION, limit=limit), limit, catalogue=size)['queries'])
+        self.assertEqual(len(page_queries), 1, "The query count of a list page grows with the catalogue")
+        self.assertEqual(len(full_queries), 1, "The query count of the list grows with the number of books")
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestDashboardBenchmark(LibraryBenchmarkCase):
+    """ Dashboard computation over growing issue histories (10k, 100k and
+    1M issues with ``LIBRARY_BENCHMARK_SIZES=10000,100000,1000000``). """
+
+    def test_dashboard_scaling(self):
+        Dashboard = self.env['library.dashboard']
+        query_counts = set()
+        for size in get_benchmark_sizes([1000, 10000]):
+            self.grow_to(size)
+            query_counts.add(self.bench('dashboard_compute', Dashboard._get_dashboard_values, 1,
+                                        issues=size)['queries'])
+        self.assertEqual(len(query_counts), 1, "The dashboard query count grows with the issue history")
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestBulkReturnBenchmark(LibraryBenchmarkCase):
+    """ Semester-end returns: 5,000 loans returned at once, in under a
+    minute. """
+
+    RETURN_COUNT = 5000
+    MAX_SECONDS = 60
+
+    def test_bulk_return_throughput(self):
+        count = get_benchmark_sizes([self.RETURN_COUNT])[-1]
+        self.env['ir.config_parameter'].sudo().set_param('library_management.loan_limit_general', 0)
+        books = self.env['library.book'].create([{
+            'name': f'Semester Book {number}',
+            'num_copies': 50,
+        } for number in range(count // 50 + 1)])
+        members = self.env['library.member'].create([{
+            'first_name': 'Student',
+            'last_name': str(number),
+            'user_type': 'general',
+        } for number in range(100)])
+        issues = self.env['library.issue'].create([{
+            'book_id': books[number // 50].id,
+            'member_id': members[number % 100].id,
+            'issue_type': 'issue',
+        } for number in range(count)])
+        issues.action_confirm()
+
+        result = self.bench('bulk_return', issues.action_bulk_return, count)
+        self.assertEqual(set(issues.mapped('state')), {'returned'})
+        self.assertLess(result['duration_ms'], self.MAX_SECONDS * 1000,
+                        f"{count} returns took more than {self.MAX_SECONDS} seconds")
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestOverdueScanBenchmark(LibraryBenchmarkCase):
+    """ Overdue scanner over growing issue tables: thanks to the (state,
+    return_date) index, a batch costs the same whatever the table size. """
+
+    def test_overdue_scan_scaling(self):
+        Issue = self.env['library.issue']
+        today = fields.Date.context_today(Issue)
+        for size in get_benchmark_sizes([1000, 10000]):
+            self.grow_to(size)
+            overdue = Issue.search_count(Issue._get_overdue_domain(today))
+            self.bench('overdue_scan_batch', Issue._cron_scan_overdue, overdue, issues=size)
+            if overdue:
+                self.assertTrue(Issue.search_count(
+                    Issue._get_overdue_domain(today) + [('overdue_scan_date', '=', today)], limit=1))
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestReportBenchmark(LibraryBenchmarkCase):
+    """ Issued-users and member reports over 10, 100 and 1,000 records: the
+    data providers read a selection with the same few queries whatever its
+    size. """
+
+    REPORTS = [
+        ('report_book_issued_users', 'library_management.action_report_book_issued_users', 'library.book'),
+        ('report_member_issued_books', 'library_management.action_report_member_issued_books', 'library.member'),
+    ]
+
+    def test_report_scaling(self):
+        sizes = get_benchmark_sizes([10, 100, 1000])
+        # enough books and members for the largest selection
+        self.grow_to(sizes[-1] * 20)
+        Report = self.env['ir.actions.report']
+        for name, report_ref, model in self.REPORTS:
+            query_counts = set()
+            for size in sizes:
+                records = self.env[model].search([], limit=size)
+                query_counts.add(self.bench(name, lambda: Report._render_qweb_html(
+                    report_ref, records.ids), len(records))['queries'])
+            self.assertEqual(len(query_counts), 1, f"The query count of {name} grows with the selection")
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestArchivalBenchmark(LibraryBenchmarkCase):
+    """ Active-loan queries before and after the returned loans are moved
+    to the archive: they only read the running loans, which are now most of
+    a much smaller issue table. """
+
+    def _bench_active_loan_queries(self, phase):
+        Issue = self.env['library.issue']
+        books = self.env['library.book'].search([])
+        issues = Issue.search_count([])
+        self.bench('dashboard_compute', self.env['library.dashboard']._get_dashboard_values, 1,
+                   phase=phase, issues=issues)
+        self.bench('active_loan_count', lambda: Issue.search_count(
+            [('state', '=', 'confirmed'), ('issue_type', '=', 'issue')]), 1, phase=phase, issues=issues)
+        self.bench('book_counters', lambda: books._compute_issue_counters(), len(books),
+                   phase=phase, issues=issues)
+
+    def test_archival(self):
+        Archive = self.env['library.issue.archive']
+        self.grow_to(get_benchmark_sizes([10000])[-1])
+        self._bench_active_loan_queries('before')
+        domain = Archive._get_archivable_domain(fields.Date.context_today(Archive))
+        running = self.env['library.issue'].search_count([('state', '=', 'confirmed')])
+        issues = self.env['library.issue'].search(domain)
+        self.bench('archive_returned_loans', lambda: Archive._archive_issues(issues), len(issues))
+        self.assertFalse(self.env['library.issue'].search_count(domain, limit=1))
+        self.assertEqual(self.env['library.issue'].search_count([('state', '=', 'confirmed')]), running)
+        self._bench_active_loan_queries('after')
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestMemberCreationBenchmark(LibraryBenchmarkCase):
+    """ Member creation one record at a time, as the import used to do,
+    against one batched create reserving the membership IDs as a block. """
+
+    def test_member_creation(self):
+        Member = self.env['library.member']
+        for size in get_benchmark_sizes([100, 1000]):
+            vals_list = [{
+                'first_name': 'Member',
+                'last_name': str(number),
+                'user_type': 'general',
+            } for number in range(size)]
+            per_record = self.bench('member_create_per_record', lambda: [
+                Member.create(dict(vals)) for vals in vals_list], size)
+            batched = self.bench('member_create_batched', lambda: Member.create([
+                dict(vals) for vals in vals_list]), size)
+            self.assertLess(batched['queries'], per_record['queries'])
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestCatalogueSearchBenchmark(LibraryBenchmarkCase):
+    """ Latency of the ranked book autocomplete (name_search) as the
+    catalogue grows, with and without a domain. """
+
+    def test_name_search_latency(self):
+        Book = self.env['library.book']
+        for size in get_benchmark_sizes([1000, 10000]):
+            self.grow_to(size * 10)
+            for word in TITLE_WORDS[:3]:
+                self.bench('name_search', lambda: Book.name_search(word, limit=8), 8, catalogue=size)
+                self.bench('name_search_domain', lambda: Book.name_search(
+                    word, domain=[('available_copies', '>', 0)], limit=8), 8, catalogue=size)
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestApiLoadBenchmark(LibraryBenchmarkCase, HttpCase):
+    """ Throughput of the kiosk API, in requests per second: checkouts,
+    availability polls and returns of batches of scans, sent one after the
+    other as the test server handles one request at a time. """
+
+    REQUESTS = 50
+    BATCH_SIZE = 10
+
+    def setUp(self):
+        super().setUp()
+        self.env['ir.config_parameter'].sudo().set_param('library_management.loan_limit_general', 0)
+        admin = self.env.ref('base.user_admin')
+        self.api_key = self.env['res.users.apikeys'].with_user(admin)._generate(
+            'rpc', 'Kiosk load test', fields.Datetime.add(fields.Datetime.now(), days=1))
+        books = self.env['library.book'].create([{
+            'name': f'Kiosk Book {number}',
+            'num_copies': self.BATCH_SIZE,
+        } for number in range(self.REQUESTS)])
+        members = self.env['library.member'].create([{
+            'first_name': 'Kiosk',
+            'last_name': str(number),
+            'user_type': 'general',
+        } for number in range(self.REQUESTS)])
+        # a batch per request: the copies of a book, scanned by a member
+        self.batches = [[{'code': copy.barcode, 'member': member.membership_id} for copy in book.copy_ids]
+                        for book, member in zip(books, members)]
+        self.env.flush_all()
+
+    def _request(self, endpoint, scans=None, params=None, headers=None):
+        headers = dict(headers or {}, Authorization=f'Bearer {self.api_key}')
+        if scans is None:
+            return self.url_open(f'{API_ROOT}/{endpoint}?{params}', headers=headers)
+        headers['Content-Type'] = 'application/json'
+        return self.url_open(f'{API_ROOT}/{endpoint}', data=json.dumps({'scans': scans}), headers=headers)
+
+    def _load(self, name, send, batches):
+        """ Send a request per batch, check its answer with ``send`` and
+        record the number of requests per second. """
+        start = time.perf_counter()
+        for batch in batches:
+            send(batch)
+        duration = time.perf_counter() - start
+        result = {
+            'name': name,
+            'records': sum(len(batch) for batch in batches),
+            'requests': len(batches),
+            'duration_ms': round(duration * 1000, 2),
+            'requests_per_second': round(len(batches) / duration, 1),
+        }
+        self.results.append(result)
+        return result
+
+    def test_api_load(self):
+        def checkout(batch):
+            response = self._request('checkout', batch)
+            self.assertEqual(response.status_code, 200, response.text)
+            self.assertEqual(len(response.json()['issued']), len(batch))
+
+        def poll(batch):
+            response = self._request('availability', params='codes=' + ','.join(scan['code'] for scan in batch))
+            self.assertEqual(response.status_code, 200, response.text)
+
+        def checkin(batch):
+            response = self._request('return', batch)
+            self.assertEqual(response.status_code, 200, response.text)
+            self.assertEqual(len(response.json()['returned']), len(batch))
+
+        self._load('api_checkout', checkout, self.batches)
+        self._load('api_availability', poll, self.batches)
+        self._load('api_return', checkin, self.batches)
+        self.env.invalidate_all()
+        self.assertFalse(self.env['library.issue'].search_count([('state', '=', 'confirmed'),
+                                                                ('book_id.name', '=like', 'Kiosk Book %')]))
+
+
+@tagged('post_install', '-at_install', 'library_benchmark')
+class TestMemberPhotoBenchmark(LibraryBenchmarkCase):
+    """ Image bytes loaded by a kanban page of members with a photo: the
+    full photos the cards used to load against the 128px variants they load
+    now. """
+
+    def test_kanban_images(self):
+        self.generator.generate(books=1, members=KANBAN_PAGE_SIZE, issues=0, photos=KANBAN_PAGE_SIZE)
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT res_field, COUNT(*), COALESCE(SUM(file_size), 0)
+              FROM ir_attachment
+             WHERE res_model = 'library.member' AND res_field IN ('photo', 'photo_128')
+               AND res_id IN (SELECT res_id FROM ir_attachment
+                               WHERE res_model = 'library.member' AND res_field = 'photo'
+                               ORDER BY res_id DESC LIMIT %s)
+             GROUP BY res_field
+        """, [KANBAN_PAGE_SIZE])
+        sizes = {res_field: (count, size) for res_field, count, size in self.env.cr.fetchall()}
+        photos, photo_bytes = sizes.get('photo', (0, 0))
+        variants, variant_bytes = sizes.get('photo_128', (0, 0))
+        self.results.append({
+            'name': 'member_kanban_images',
+            'records': photos,
+            'photo_bytes': photo_bytes,
+            'photo_128_bytes': variant_bytes,
+        })
+        self.assertEqual(variants, photos, "A photo has no 128px variant")
+        self.assertLess(variant_bytes, photo_bytes)
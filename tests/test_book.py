@@ -0,0 +1,14 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestBook(LibraryTestCommon):
+
+    def test_create_returns_records(self):
+        # whatever the context, e.g. a form of the web client
+        books = self.env['library.book'].with_context(from_ui=True).create([{'name': 'Single Book', 'num_copies': 2}])
+        self.assertEqual(books._name, 'library.book')
+        self.assertEqual(len(books.copy_ids), 2)
+        self.assertEqual(books.action_book_added()['effect']['type'], 'rainbow_man')
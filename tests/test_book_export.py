@@ -0,0 +1,32 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestBookExport(LibraryTestCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.books = cls._create_books(5)
+
+    def _export_domain(self, books, **context):
+        action = books.with_context(active_model='library.book', **context).action_export_book_excel()
+        export = self.env['library.book.export'].browse(int(action['url'].rsplit('/', 1)[1]))
+        return export.domain
+
+    def test_export_selection(self):
+        # the list view sends its domain along with a partial selection
+        selection = self.books[:2]
+        domain = self._export_domain(selection, active_ids=selection.ids, active_domain=[])
+        self.assertEqual(domain, repr([('id', 'in', selection.ids)]))
+
+    def test_export_select_all_beyond_limit(self):
+        # "select all" over more books than the client fetches: the ids are
+        # truncated to web.active_ids_limit, the domain is exported instead
+        self.env['ir.config_parameter'].sudo().set_param('web.active_ids_limit', 3)
+        selection = self.books[:3]
+        active_domain = [('name', 'like', 'Book')]
+        domain = self._export_domain(selection, active_ids=selection.ids, active_domain=active_domain)
+        self.assertEqual(domain, repr(active_domain))
@@ -0,0 +1,40 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCatalogueSearch(LibraryTestCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.books = cls.env['library.book'].create([
+            {'name': 'Dune', 'author': 'Frank Herbert', 'category': 'sci_fi'},
+            {'name': 'Dune Messiah', 'author': 'Frank Herbert', 'category': 'sci_fi'},
+            {'name': 'Children of Dune', 'author': 'Frank Herbert', 'category': 'sci_fi'},
+            {'name': 'The Dune Encyclopedia', 'author': 'Willis McNelly', 'category': 'other'},
+            {'name': '100% Pure', 'author': 'Anonymous', 'category': 'other'},
+            {'name': '1000 Pure Recipes', 'author': 'Anonymous', 'category': 'other'},
+        ])
+
+    def test_name_search_ranking(self):
+        results = self.env['library.book'].name_search('dune')
+        self.assertEqual([book_id for book_id, _name in results][:2], self.books[:2].ids)
+        self.assertEqual(len(results), 4)
+
+    def test_name_search_domain(self):
+        # the domain restricts the ranked search itself, however many
+        # better matches it excludes
+        results = self.env['library.book'].name_search('dune', domain=[('category', '=', 'other')], limit=1)
+        self.assertEqual([book_id for book_id, _name in results], self.books[3].ids)
+
+    def test_name_search_no_limit(self):
+        results = self.env['library.book'].name_search('dune', limit=None)
+        self.assertEqual(len(results), 4)
+
+    def test_name_search_wildcards(self):
+        # % and _ are searched for, not used as wildcards
+        results = self.env['library.book'].name_search('100%')
+        self.assertEqual([book_id for book_id, _name in results], self.books[4].ids)
+        self.assertFalse(self.env['library.book'].name_search('D_ne'))
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCirculationStats(LibraryTestCommon):
+
+    def _issue_count(self, day):
+        Stats = self.env['library.circulation.stats']
+        return sum(Stats.search([('date', '=', day), ('book_id', '=', self.book.id)]).mapped('issue_count'))
+
+    def test_incremental_refresh(self):
+        Stats = self.env['library.circulation.stats']
+        self.book = self._create_books(1)
+        member = self._create_members(1)
+        today = fields.Date.context_today(Stats)
+        yesterday = today - timedelta(days=1)
+        issue = self.env['library.issue'].create({
+            'book_id': self.book.id,
+            'member_id': member.id,
+            'issue_type': 'issue',
+            'issue_date': yesterday,
+        })
+        issue.action_confirm()
+        Stats._refresh(full=True)
+        self.assertEqual(self._issue_count(yesterday), 1)
+
+        # the day the issue moves away from is recomputed too
+        issue.issue_date = today
+        Stats._refresh()
+        self.assertEqual(self._issue_count(yesterday), 0)
+        self.assertEqual(self._issue_count(today), 1)
+
+        # as are the days of a deleted issue
+        issue.unlink()
+        Stats._refresh()
+        self.assertEqual(self._issue_count(today), 0)
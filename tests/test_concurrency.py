@@ -0,0 +1,106 @@
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import LibraryConcurrencyCase
+
+
+@tagged('post_install', '-at_install')
+class TestConcurrentCheckout(LibraryConcurrencyCase):
+    """ Desks confirming loans of the same book at the same time never get
+    the same copy, nor two copies for one loan. """
+
+    COPIES = 3
+    DESKS = 8
+
+    def setUp(self):
+        super().setUp()
+        self.book_id, = self.create_committed('library.book', [{'name': 'Concurrent Book', 'num_copies': self.COPIES}])
+        self.member_ids = self.create_committed('library.member', [{
+            'first_name': 'Desk',
+            'last_name': str(number),
+            'user_type': 'faculty',
+        } for number in range(self.DESKS)])
+
+    def _create_issues(self, member_ids):
+        return self.create_committed('library.issue', [{
+            'book_id': self.book_id,
+            'member_id': member_id,
+            'issue_type': 'issue',
+        } for member_id in member_ids])
+
+    def _read_loans(self):
+        def read(env):
+            issues = env['library.issue'].search([('book_id', '=', self.book_id), ('state', '=', 'confirmed')])
+            loaned = env['library.book.copy'].search([('book_id', '=', self.book_id), ('status', '=', 'loaned')])
+            return issues.copy_id.ids, len(issues), loaned.ids
+        return self.run_committed(read)
+
+    def test_concurrent_confirm_same_book(self):
+        issue_ids = self._create_issues(self.member_ids)
+        results = self.run_concurrently(
+            lambda env, issue_id: env['library.issue'].browse(issue_id).action_confirm(),
+            [(issue_id,) for issue_id in issue_ids])
+
+        self.assertEqual(results.count(None), self.COPIES, "Every copy is lent once the races are retried")
+        for error in filter(None, results):
+            self.assertIsInstance(error, UserError)
+        copy_ids, loans, loaned_ids = self._read_loans()
+        self.assertEqual(loans, self.COPIES)
+        self.assertEqual(len(set(copy_ids)), self.COPIES, "A copy was lent twice")
+        self.assertEqual(sorted(copy_ids), sorted(loaned_ids))
+
+    def test_concurrent_confirm_same_issue(self):
+        issue_id, = self._create_issues(self.member_ids[:1])
+        results = self.run_concurrently(
+            lambda env: env['library.issue'].browse(issue_id).action_confirm(), [()] * self.DESKS)
+
+        self.assertEqual(results.count(None), 1, "The issue was confirmed more than once")
+        for error in filter(None, results):
+            self.assertIsInstance(error, UserError)
+        copy_ids, loans, loaned_ids = self._read_loans()
+        self.assertEqual(loans, 1)
+        self.assertEqual(len(loaned_ids), 1, "A second copy was claimed for the same issue")
+
+
+@tagged('post_install', '-at_install')
+class TestConcurrentReturns(LibraryConcurrencyCase):
+    """ Copies of the same book returned at several desks at once are held
+    for distinct reservations of its queue. """
+
+    COPIES = 4
+
+    def setUp(self):
+        super().setUp()
+        self.book_id, = self.create_committed('library.book', [{'name': 'Reserved Book', 'num_copies': self.COPIES}])
+        member_ids = self.create_committed('library.member', [{
+            'first_name': 'Reader',
+            'last_name': str(number),
+            'user_type': 'faculty',
+        } for number in range(2 * self.COPIES + 1)])
+        self.issue_ids = self.create_committed('library.issue', [{
+            'book_id': self.book_id,
+            'member_id': member_id,
+            'issue_type': 'issue',
+        } for member_id in member_ids[:self.COPIES]])
+        self.run_committed(lambda env: env['library.issue'].browse(self.issue_ids).action_confirm())
+        self.reservation_ids = self.create_committed('library.reservation', [{
+            'book_id': self.book_id,
+            'member_id': member_id,
+        } for member_id in member_ids[self.COPIES:]])
+
+    def test_concurrent_returns(self):
+        results = self.run_concurrently(
+            lambda env, issue_id: env['library.issue'].browse(issue_id).action_return(),
+            [(issue_id,) for issue_id in self.issue_ids])
+        self.assertEqual(results, [None] * self.COPIES)
+
+        def read(env):
+            reservations = env['library.reservation'].browse(self.reservation_ids)
+            held = reservations.filtered(lambda r: r.state == 'held')
+            reserved = env['library.book.copy'].search([('book_id', '=', self.book_id), ('status', '=', 'reserved')])
+            return held.ids, held.copy_id.ids, reserved.ids, reservations.filtered(lambda r: r.copy_id).ids
+        held_ids, held_copy_ids, reserved_ids, with_copy_ids = self.run_committed(read)
+        self.assertEqual(held_ids, self.reservation_ids[:self.COPIES], "The queue was not served in order")
+        self.assertEqual(len(held_copy_ids), self.COPIES, "A copy was held for two reservations")
+        self.assertEqual(sorted(held_copy_ids), sorted(reserved_ids), "A copy is reserved for no reservation")
+        self.assertEqual(with_copy_ids, held_ids)
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestIssue(LibraryTestCommon):
+
+    def test_extended_loan_is_no_longer_overdue(self):
+        book = self._create_books(1)
+        member = self._create_members(1)
+        today = fields.Date.context_today(self.env['library.issue'])
+        issue = self.env['library.issue'].create({
+            'book_id': book.id,
+            'member_id': member.id,
+            'issue_type': 'issue',
+            'issue_date': today - timedelta(days=20),
+            'return_date': today - timedelta(days=5),
+        })
+        issue.action_confirm()
+        self.env['library.issue']._cron_scan_overdue()
+        self.assertEqual(issue.overdue_days, 5)
+        self.assertTrue(issue.accrued_penalty)
+
+        issue.return_date = today + timedelta(days=7)
+        self.assertEqual(issue.overdue_days, 0)
+        self.assertEqual(issue.accrued_penalty, 0.0)
+        self.assertFalse(issue.overdue_scan_date)
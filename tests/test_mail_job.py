@@ -0,0 +1,33 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestMailJob(LibraryTestCommon):
+
+    def test_reconcile_queued_jobs(self):
+        member = self._create_members(1)
+        template = self.env.ref('library_management.mail_template_library_member_welcome')
+        Mail = self.env['mail.mail'].sudo()
+        outgoing, failed, sent = Mail.create([{
+            'subject': 'Welcome',
+            'email_to': 'member@example.com',
+            'state': state,
+            'failure_reason': 'Connection refused' if state == 'exception' else False,
+        } for state in ('outgoing', 'exception', 'sent')])
+        deleted = Mail.create({'subject': 'Welcome', 'email_to': 'member@example.com'})
+        jobs = self.env['library.mail.job'].create([{
+            'template_id': template.id,
+            'res_model': 'library.member',
+            'res_id': member.id,
+            'mail_id': mail.id,
+            'state': 'queued',
+        } for mail in (outgoing, failed, sent, deleted)])
+        # auto-deleted once sent by the standard mail queue
+        deleted.unlink()
+
+        self.env['library.mail.job']._reconcile_queued_jobs()
+        self.assertEqual(jobs.mapped('state'), ['queued', 'failed', 'sent', 'sent'])
+        self.assertEqual(jobs[1].error, 'Connection refused')
+        self.assertTrue(all(jobs[2:].mapped('sent_date')))
@@ -0,0 +1,56 @@
+import base64
+import io
+
+from PIL import Image
+
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+def _make_image(size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, 'JPEG')
+    return base64.b64encode(buffer.getvalue())
+
+
+def _image_size(value):
+    return Image.open(io.BytesIO(base64.b64decode(value))).size
+
+
+@tagged('post_install', '-at_install')
+class TestMemberPhoto(LibraryTestCommon):
+
+    def test_photo_variants(self):
+        member = self._create_members(1)
+        member.photo = _make_image((2000, 1500))
+        self.assertEqual(_image_size(member.photo), (1024, 768))
+        self.assertEqual(_image_size(member.photo_512), (512, 384))
+        self.assertEqual(_image_size(member.photo_128), (128, 96))
+
+    def test_resize_former_photos(self):
+        members = self._create_members(3)
+        # a photo uploaded by a former version: full size, without variants
+        for member in members:
+            self.env['ir.attachment'].sudo().create({
+                'name': 'photo',
+                'res_model': 'library.member',
+                'res_field': 'photo',
+                'res_id': member.id,
+                'datas': _make_image((2000, 1500)),
+            })
+        members.invalidate_recordset()
+        self.assertFalse(members.filtered('photo_128'))
+
+        # start after the photos of the members already there
+        self.env['ir.config_parameter'].sudo().set_param(
+            'library_management.image_migration_library.member.photo', members[0].id - 1)
+        Migration = self.env['library.image.migration']
+        done, remaining = Migration._resize_images('library.member', 'photo', 2)
+        self.assertEqual((done, remaining), (2, 1))
+        done, remaining = Migration._resize_images('library.member', 'photo', 2)
+        self.assertEqual((done, remaining), (1, 0))
+        members.invalidate_recordset()
+        for member in members:
+            self.assertEqual(_image_size(member.photo), (1024, 768))
+            self.assertEqual(_image_size(member.photo_128), (128, 96))
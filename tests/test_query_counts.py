@@ -0,0 +1,56 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+ISSUE_COUNT = 1000
+# Queries of a mass operation that do not depend on the number of records;
+# confirming and returning cost one more query per copy claimed or released
+CONSTANT_QUERIES = 100
+
+
+@tagged('post_install', '-at_install')
+class TestIssueQueryCount(LibraryTestCommon):
+    """ Mass confirmation and return of 1,000 issues: the book counters are
+    recomputed once per batch, not once per issue or per book. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # the audit trail is measured on its own (library.mail.usage)
+        cls.env['ir.config_parameter'].sudo().set_param('library_management.audit_mode', 'off')
+        cls.books = cls._create_books(50, copies=ISSUE_COUNT // 50)
+        cls.members = cls._create_members(10)
+
+    def _create_issues(self):
+        issues = self.env['library.issue'].create([{
+            'book_id': self.books[number % len(self.books)].id,
+            'member_id': self.members[number % len(self.members)].id,
+            'issue_type': 'issue',
+        } for number in range(ISSUE_COUNT)])
+        self.env.flush_all()
+        self.env.invalidate_all()
+        return issues
+
+    def test_mass_confirm(self):
+        issues = self._create_issues()
+        with self.assertQueryCount(ISSUE_COUNT + CONSTANT_QUERIES):
+            issues.action_confirm()
+        self.assertEqual(set(issues.mapped('state')), {'confirmed'})
+        self.assertEqual(set(self.books.mapped('available_copies')), {0})
+        self.assertEqual(set(self.books.mapped('times_issued')), {ISSUE_COUNT // 50})
+
+    def test_mass_return(self):
+        issues = self._create_issues()
+        issues.action_confirm()
+        self.env.flush_all()
+        self.env.invalidate_all()
+        with self.assertQueryCount(ISSUE_COUNT + CONSTANT_QUERIES):
+            issues.action_bulk_return()
+        self.assertEqual(set(issues.mapped('state')), {'returned'})
+        self.assertEqual(set(self.books.mapped('available_copies')), {ISSUE_COUNT // 50})
+
+    def test_mass_payment_write(self):
+        # a field the book counters do not depend on
+        issues = self._create_issues()
+        with self.assertQueryCount(CONSTANT_QUERIES):
+            issues.write({'payment_status': 'paid'})
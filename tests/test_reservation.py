@@ -0,0 +1,75 @@
+from odoo.tests import tagged
+
+from .common import LibraryTestCommon
+
+
+@tagged('post_install', '-at_install')
+class TestReservation(LibraryTestCommon):
+
+    COPIES = 3
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.book = cls._create_books(1, copies=cls.COPIES)
+        cls.borrowers = cls._create_members(cls.COPIES)
+        cls.waiting = cls._create_members(cls.COPIES + 1, user_type='student')
+
+    def test_bulk_return_serves_distinct_reservations(self):
+        issues = self.env['library.issue'].create([{
+            'book_id': self.book.id,
+            'member_id': member.id,
+            'issue_type': 'issue',
+        } for member in self.borrowers])
+        issues.action_confirm()
+        reservations = self.env['library.reservation'].create([{
+            'book_id': self.book.id,
+            'member_id': member.id,
+        } for member in self.waiting])
+        self.assertEqual(set(reservations.mapped('state')), {'waiting'})
+
+        # the copies returned together go to the first reservations, one each
+        issues.action_bulk_return()
+        served, last = reservations[:self.COPIES], reservations[self.COPIES:]
+        self.assertEqual(set(served.mapped('state')), {'held'})
+        self.assertTrue(all(served.mapped('hold_expiry')))
+        self.assertEqual(served.copy_id, issues.copy_id)
+        self.assertEqual(last.state, 'waiting')
+        self.assertFalse(last.copy_id)
+        reserved = self.env['library.book.copy'].search([('book_id', '=', self.book.id), ('status', '=', 'reserved')])
+        self.assertEqual(reserved, served.copy_id, "A copy is reserved for no reservation")
+
+    def test_checkout_scanned_reservation_once(self):
+        book = self._create_books(1, copies=2)
+        member = self.waiting[0]
+        reservation = self.env['library.reservation'].create({'book_id': book.id, 'member_id': member.id})
+        self.assertEqual(reservation.state, 'held')
+        other_copy = book.copy_ids - reservation.copy_id
+
+        # the ISBN checks the reservation out, the held copy cannot be lent
+        # a second time, the other copy is lent as usual
+        result = self.env['library.issue'].checkout_scanned([
+            (book.isbn, member.membership_id),
+            (reservation.copy_id.barcode, member.membership_id),
+            (other_copy.barcode, member.membership_id),
+        ])
+        self.assertEqual(reservation.state, 'fulfilled')
+        self.assertEqual(reservation.issue_id.copy_id, reservation.copy_id)
+        issues = self.env['library.issue'].browse(result['issued'])
+        self.assertEqual(issues.copy_id, book.copy_ids)
+        self.assertEqual([error[0] for error in result['errors']], [reservation.copy_id.barcode])
+
+    def test_checkout_other_copy_after_reservation(self):
+        book = self._create_books(1, copies=2)
+        member = self.waiting[1]
+        reservation = self.env['library.reservation'].create({'book_id': book.id, 'member_id': member.id})
+
+        # the held copy, then the ISBN: a second copy for the same member
+        result = self.env['library.issue'].checkout_scanned([
+            (reservation.copy_id.barcode, member.membership_id),
+            (book.isbn, member.membership_id),
+        ])
+        self.assertFalse(result['errors'])
+        self.assertEqual(reservation.state, 'fulfilled')
+        issues = self.env['library.issue'].browse(result['issued'])
+        self.assertEqual(issues.copy_id, book.copy_ids)
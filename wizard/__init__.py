@@ -1 +1,4 @@
-from.import library_wizard_issue_return
\ No newline at end of file
+from.import library_wizard_issue_return
+from.import library_import_mixin
+from.import library_book_import
+from.import library_member_import
\ No newline at end of file
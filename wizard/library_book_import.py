@@ -0,0 +1,131 @@
+from odoo import models, fields, api, _
+from ..models.library_book import normalize_isbn, is_valid_isbn, isbn_to_13
+from collections import defaultdict
+import time
+
+
+class LibraryBookImportWizard(models.TransientModel):
+    _name = 'library.book.import.wizard'
+    _inherit = ['library.import.mixin']
+    _description = 'Import Books Wizard'
+
+    _import_columns = {
+        'name': 'name',
+        'title': 'name',
+        'author': 'author',
+        'isbn': 'isbn',
+        'publication_date': 'publication_date',
+        'copies': 'num_copies',
+        'num_copies': 'num_copies',
+        'category': 'category',
+        'purchase_price': 'purchase_price',
+        'issue_price': 'issue_price',
+    }
+    _import_required_columns = ('name', 'isbn')
+
+    created_count = fields.Integer(string="Books Created")
+    updated_count = fields.Integer(string="Books Updated", readonly=True)
+
+    @api.model
+    def _parse_row(self, row, categories):
+        """ Convert a CSV row to book values, raise ValueError when invalid. """
+        if not row.get('name'):
+            raise ValueError(_("missing title"))
+        isbn = normalize_isbn(row.get('isbn'))
+        if not is_valid_isbn(isbn):
+            raise ValueError(_("invalid ISBN %s", row.get('isbn')))
+        vals = {'name': row['name'], 'isbn': isbn, 'num_copies': int(row.get('num_copies') or 1)}
+        if vals['num_copies'] < 0:
+            raise ValueError(_("negative number of copies"))
+        if row.get('author'):
+            vals['author'] = row['author']
+        if row.get('publication_date'):
+            vals['publication_date'] = fields.Date.to_date(row['publication_date'])
+        if row.get('category'):
+            category = categories.get(row['category'].lower())
+            if not category:
+                raise ValueError(_("unknown category %s", row['category']))
+            vals['category'] = category
+        for fname in ('purchase_price', 'issue_price'):
+            if row.get(fname):
+                vals[fname] = float(row[fname])
+        return vals
+
+    def action_import(self):
+        self.ensure_one()
+        Book = self.env['library.book'].with_context(
+            tracking_disable=True, mail_create_nolog=True, mail_create_nosubscribe=True)
+        categories = self._get_selection_lookup('library.book', 'category')
+
+        created = updated = 0
+        errors = []
+        start = time.time()
+        nb_rows = 0
+        for chunk in self._iter_chunks():
+            nb_rows += len(chunk)
+            # copies to add per ISBN-13, the first valid row of a book gives its values
+            vals_by_isbn = {}
+            copies_by_isbn = defaultdict(int)
+            lineno_by_isbn = {}
+            for lineno, row in chunk:
+                try:
+                    vals = self._parse_row(row, categories)
+                except ValueError as e:
+                    errors.append(_("Line %(line)s: %(error)s", line=lineno, error=e))
+                    continue
+                isbn13 = isbn_to_13(vals['isbn'])
+                vals_by_isbn.setdefault(isbn13, vals)
+                lineno_by_isbn.setdefault(isbn13, lineno)
+                copies_by_isbn[isbn13] += vals['num_copies']
+            if not vals_by_isbn:
+                continue
+
+            # one indexed query to find the titles the library already has,
+            # whatever the form their ISBN was entered in
+            existing = Book.search([('isbn13', 'in', list(vals_by_isbn))])
+            existing_by_isbn = {book.isbn13: book for book in existing}
+            try:
+                with self.env.cr.savepoint():
+                    nb_created, nb_updated = self._import_books(Book, vals_by_isbn, copies_by_isbn, existing_by_isbn)
+            except Exception:  # noqa: BLE001 find the faulty rows one by one
+                self.env.invalidate_all()
+                nb_created = nb_updated = 0
+                for isbn, vals in vals_by_isbn.items():
+                    try:
+                        with self.env.cr.savepoint():
+                            row_created, row_updated = self._import_books(
+                                Book, {isbn: vals}, copies_by_isbn, existing_by_isbn)
+                    except Exception as e:  # noqa: BLE001 reported, the import goes on
+                        errors.append(_("Line %(line)s: %(error)s", line=lineno_by_isbn[isbn], error=e))
+                        continue
+                    nb_created += row_created
+                    nb_updated += row_updated
+            created += nb_created
+            updated += nb_updated
+            self.env.invalidate_all()
+
+        return self._show_result({
+            'created_count': created,
+            'updated_count': updated,
+            'error_count': len(errors),
+            'error_log': "\n".join(errors),
+        }, nb_rows, time.time() - start)
+
+    @api.model
+    def _import_books(self, Book, vals_by_isbn, copies_by_isbn, existing_by_isbn):
+        """ Add the copies to the existing titles and create the new ones in
+        one batch. Returns the number of books created and updated. """
+        books = Book.browse([existing_by_isbn[isbn].id for isbn in vals_by_isbn if isbn in existing_by_isbn])
+        # one write per resulting number of copies rather than one per book
+        books_by_total = defaultdict(lambda: Book.browse())
+        for book in books:
+            books_by_total[book.num_copies + copies_by_isbn[book.isbn13]] |= book
+        for total, group in books_by_total.items():
+            group.write({'num_copies': total})
+
+        Book.create([
+            dict(vals, num_copies=copies_by_isbn[isbn])
+            for isbn, vals in vals_by_isbn.items() if isbn not in existing_by_isbn
+        ])
+        self.env.flush_all()
+        return len(vals_by_isbn) - len(books), len(books)
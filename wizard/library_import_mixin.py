@@ -0,0 +1,77 @@
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+import base64
+import csv
+import io
+
+
+class LibraryImportMixin(models.AbstractModel):
+    _name = 'library.import.mixin'
+    _description = 'Library CSV Import'
+
+    # CSV header -> field name, set by the inheriting wizards
+    _import_columns = {}
+    _import_required_columns = ()
+
+    file = fields.Binary(string="CSV File", required=True)
+    filename = fields.Char(string="File Name")
+    delimiter = fields.Selection([
+        (',', 'Comma'),
+        (';', 'Semicolon'),
+        ('\t', 'Tab'),
+    ], string="Separator", default=',', required=True)
+    chunk_size = fields.Integer(string="Rows per Batch", default=1000)
+
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+    created_count = fields.Integer(string="Records Created", readonly=True)
+    error_count = fields.Integer(string="Rows Rejected", readonly=True)
+    error_log = fields.Text(string="Errors", readonly=True)
+    duration = fields.Float(string="Duration (s)", readonly=True, digits=(16, 2))
+    rows_per_second = fields.Float(string="Rows/sec", readonly=True, digits=(16, 1))
+
+    def _iter_rows(self):
+        """ Yield ``(line number, {field: value})`` for each CSV row. """
+        content = io.TextIOWrapper(io.BytesIO(base64.b64decode(self.file)), encoding='utf-8-sig', newline='')
+        reader = csv.reader(content, delimiter=self.delimiter)
+        header = next(reader, None)
+        if not header:
+            raise UserError(_("The file is empty."))
+        columns = [self._import_columns.get(col.strip().lower().replace(' ', '_')) for col in header]
+        missing = [fname for fname in self._import_required_columns if fname not in columns]
+        if missing:
+            raise UserError(_("Missing columns in the file: %s", ", ".join(missing)))
+        for lineno, row in enumerate(reader, start=2):
+            if any(cell.strip() for cell in row):
+                yield lineno, {col: cell.strip() for col, cell in zip(columns, row) if col}
+
+    def _iter_chunks(self):
+        chunk = []
+        for item in self._iter_rows():
+            chunk.append(item)
+            if len(chunk) >= max(self.chunk_size, 1):
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _get_selection_lookup(self, model, fname):
+        """ Map the lowercased keys and labels of a selection field to its keys. """
+        lookup = {}
+        for key, label in self.env[model]._fields[fname]._description_selection(self.env):
+            lookup[key.lower()] = lookup[label.lower()] = key
+        return lookup
+
+    def _show_result(self, values, nb_rows, duration):
+        values.update({
+            'state': 'done',
+            'duration': duration,
+            'rows_per_second': nb_rows / duration if duration else 0.0,
+        })
+        self.write(values)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -1,5 +1,7 @@
-from odoo import models, fields, api
-from datetime import date
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from ..models.library_perf import profiled
+import re
 
 class LibraryIssueReturnWizard(models.TransientModel):
     _name = 'library.issue.return.wizard'
@@ -29,7 +31,7 @@ class LibraryIssueReturnWizard(models.TransientModel):
         tracking=True
     )
 
-    penalty_per_day = fields.Float(string="Penalty Rate Per Day", default=10.0)
+    penalty_per_day = fields.Float(string="Penalty Rate Per Day", default=lambda self: self.env['library.issue']._get_penalty_per_day())
 
     @api.depends('return_date', 'issue_id.return_date')
     def _compute_penalty(self):
@@ -42,24 +44,68 @@ class LibraryIssueReturnWizard(models.TransientModel):
                 wizard.extra_days = 0
                 wizard.penalty_amount = 0.0
     
+    @profiled
     def confirm_return(self):
         self.ensure_one()
 
-        # Write updates to the issue record
-        self.issue_id.write({
-            'actual_return_date': self.return_date,
-            'penalty': self.penalty_amount,
-            'state': 'returned',
-        })
+        with self.issue_id._audit_operation('library.issue.return'):
+            # Write updates to the issue record
+            self.issue_id.write({
+                'actual_return_date': self.return_date,
+                'penalty': self.penalty_amount,
+                'state': 'returned',
+            })
 
-        # Post a message to the chatter
-        msg = f" Book returned on {self.return_date.strftime('%d-%m-%Y')}."
-        if self.extra_days > 0:
-            msg += f"\n Returned {self.extra_days} day(s) late."
-            msg += f"\n Penalty applied: ₹{self.penalty_amount:.2f} (₹{self.penalty_per_day}/day)"
-        else:
-            msg += "\n Returned within allowed period (No penalty)."
+            # Record the return message according to the audit mode
+            msg = self.issue_id._get_return_message(self.return_date, self.extra_days, self.penalty_amount, self.penalty_per_day)
+            self.issue_id._audit_message({self.issue_id.id: msg}, 'return')
 
-        self.issue_id.message_post(body=msg)
+        return {'type': 'ir.actions.act_window_close'}
+
+
+class LibraryIssueBulkReturnWizard(models.TransientModel):
+    _name = 'library.issue.bulk.return.wizard'
+    _description = 'Bulk Return Books Wizard'
+
+    issue_ids = fields.Many2many('library.issue', string="Issued Records",
+                                 domain="[('issue_type', '=', 'issue'), ('state', '=', 'confirmed')]")
+    scan_lines = fields.Text(
+        string="Scanned Returns",
+        help="One return per line: the book ISBN and the membership ID, separated by a comma, a tab or a space.",
+    )
+    return_date = fields.Date(string="Return Date", default=fields.Date.context_today, required=True)
+    penalty_per_day = fields.Float(string="Penalty Rate Per Day", default=lambda self: self.env['library.issue']._get_penalty_per_day())
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if 'issue_ids' in fields_list and self.env.context.get('active_model') == 'library.issue':
+            res['issue_ids'] = [(6, 0, self.env.context.get('active_ids', []))]
+        return res
+
+    def _parse_scan_lines(self):
+        scans = []
+        for line in (self.scan_lines or '').splitlines():
+            parts = [part for part in re.split(r'[,;\t ]+', line.strip()) if part]
+            if not parts:
+                continue
+            if len(parts) != 2:
+                raise UserError(_("Invalid scanned line: %s", line))
+            scans.append(tuple(parts))
+        return scans
+
+    @profiled
+    def confirm_return(self):
+        self.ensure_one()
+        issues = self.issue_ids
+        scans = self._parse_scan_lines()
+        if scans:
+            scanned, not_found = self.env['library.issue']._find_scanned_loans(scans)
+            if not_found:
+                raise UserError(_("No open loan found for: %s", ", ".join(" / ".join(pair) for pair in not_found)))
+            issues |= scanned
+        if not issues:
+            raise UserError(_("Select or scan at least one issued book to return."))
 
+        issues._bulk_return(self.return_date, self.penalty_per_day)
         return {'type': 'ir.actions.act_window_close'}